@@ -0,0 +1,139 @@
+import argparse
+import glob
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+
+# Measures the cold start of every plugin task
+#
+#   python benchmark_startup.py [--repeat 5] [--json]
+#
+# Every task of the plugin ymls (and every hook) is started in a fresh python process. The time to load the plugin
+# module and the time until the first request to stash would be sent are measured, then the task is aborted,
+# so nothing is sent to stash and no stash instance is needed.
+
+plugin_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Tasks that have side effects before their first request to stash
+skipped_tasks = {('yt-dl_downloader', 'download')}
+
+# Modules that should only be loaded by the tasks that need them
+heavy_modules = ('requests', 'youtube_dl')
+
+
+# Raised instead of sending the first request, derived from BaseException so tasks don't catch it
+class FirstRequest(BaseException):
+    pass
+
+
+# Returns [(plugin, mode, hook)] of all tasks and hooks defined in the plugin ymls
+def find_tasks():
+    tasks = []
+    for yml in sorted(glob.glob(os.path.join(plugin_dir, '..', '*.yml'))):
+        with open(yml) as yml_file:
+            content = yml_file.read()
+        script = re.search(r'py_plugins/([\w\-]+)\.py', content)
+        if script is None:
+            continue
+        plugin = script.group(1)
+        task_section, _, hook_section = content.partition('\nhooks:')
+        # Tasks without defaultArgs run with an empty mode
+        for task in task_section.split('- name:')[1:]:
+            mode = re.search(r'^\s+mode:\s*(\S+)', task, re.MULTILINE)
+            mode = mode.group(1) if mode else ''
+            if (plugin, mode) not in skipped_tasks:
+                tasks.append((plugin, mode, None))
+        for hook in re.findall(r'^\s+-\s*(\w+\.\w+\.Post)\s*$', hook_section, re.MULTILINE):
+            tasks.append((plugin, '', hook))
+    return tasks
+
+
+# Runs in the child process, prints the measurements as json
+def measure(plugin_name, mode, hook):
+    start = time.perf_counter()
+    # Even if the abort below doesn't work, don't change anything
+    os.environ['STASH_PLUGIN_DRY_RUN'] = '1'
+    import run_task
+
+    result = {'plugin': plugin_name, 'mode': mode, 'hook': hook, 'error': None, 'first_request': None}
+    plugin = run_task.load_plugin(plugin_name)
+    result['import'] = time.perf_counter() - start
+
+    import stash_interface
+
+    def first_request(self, query, variables=None):
+        # Includes the setup of the connection pool
+        stash_interface.get_session()
+        raise FirstRequest()
+
+    stash_interface.StashInterface._StashInterface__callGraphQL = first_request
+
+    args = {'mode': mode}
+    if hook:
+        args['hookContext'] = {'id': '1', 'type': hook}
+    json_input = {'server_connection': run_task.server_connection(run_task.parse_args(['benchmark'])), 'args': args}
+    try:
+        plugin.run(json_input, {})
+    except FirstRequest:
+        result['first_request'] = time.perf_counter() - start
+    except BaseException as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    result['modules'] = [module for module in heavy_modules if module in sys.modules]
+    print(json.dumps(result))
+
+
+def run_task_process(plugin, mode, hook):
+    command = [sys.executable, os.path.abspath(__file__), '--child', plugin, mode]
+    if hook:
+        command.append(hook)
+    start = time.perf_counter()
+    process = subprocess.run(command, cwd=plugin_dir, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                             universal_newlines=True)
+    total = time.perf_counter() - start
+    try:
+        result = json.loads(process.stdout.strip().splitlines()[-1])
+    except (IndexError, ValueError):
+        result = {'plugin': plugin, 'mode': mode, 'hook': hook, 'error': f"exit code {process.returncode}",
+                  'import': None, 'first_request': None, 'modules': []}
+    result['total'] = total
+    return result
+
+
+def __ms(seconds):
+    return f"{seconds * 1000:8.1f}" if seconds is not None else f"{'-':>8}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the cold start time of all plugin tasks")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per task, the fastest run is reported")
+    parser.add_argument('--json', action='store_true', help="print the results as json")
+    parser.add_argument('--child', nargs='+', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        plugin, mode, hook = (args.child + ['', None])[:3]
+        measure(plugin, mode, hook)
+        return
+
+    results = []
+    for plugin, mode, hook in find_tasks():
+        runs = [run_task_process(plugin, mode, hook) for _ in range(max(1, args.repeat))]
+        results.append(min(runs, key=lambda r: r['total']))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'task':<45} {'import':>8} {'request':>8} {'total':>8}  loaded modules / error")
+    for result in results:
+        task = f"{result['plugin']} {result['hook'] or result['mode'] or 'task'}"
+        details = result['error'] or ', '.join(result['modules'])
+        print(f"{task:<45} {__ms(result['import'])} {__ms(result['first_request'])} {__ms(result['total'])}  {details}")
+    print("Times in ms: plugin import, first request to stash, whole process")
+
+
+if __name__ == '__main__':
+    main()
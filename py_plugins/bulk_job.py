@@ -0,0 +1,300 @@
+import threading
+import time
+from queue import Queue
+
+import log
+import metrics
+import stash_interface
+from changes import group_changes
+from checkpoint import Journal
+from concurrency import AIMDController
+from progress import ProgressReporter
+from work_queue import TimeBudget, cancellation
+
+# Number of attempts for failed mutations caused by connection problems, timeouts and 5xx/429 responses
+retries = 3
+
+# Marks the end of the work queue
+_STOP = object()
+
+# Number of error messages kept per job for the run summary
+max_errors = 20
+
+# Number of entities whose bulk changes are sent in a single request by grouped_sink
+grouped_batch_size = 250
+
+
+# Counts of a finished bulk job
+class JobStats:
+    def __init__(self, name):
+        self.name = name
+        self.scanned = 0
+        self.updated = 0
+        self.skipped = 0
+        self.failed = 0
+        self.elapsed = 0.0
+        self.interrupted = False
+        # First max_errors error messages
+        self.errors = []
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'scanned': self.scanned,
+            'updated': self.updated,
+            'skipped': self.skipped,
+            'failed': self.failed,
+            'elapsed': round(self.elapsed, 3),
+            'interrupted': self.interrupted,
+            'errors': self.errors
+        }
+
+    def __str__(self):
+        return (f"{self.name}: {self.updated} updated, {self.skipped} skipped, {self.failed} failed "
+                f"of {self.scanned} in {self.elapsed:.1f}s")
+
+
+# Batch sink for transforms returning bulk changes (see changes.bulk_change)
+# The changes of a batch are grouped and sent in a single request, send is e.g. StashInterface.bulkSceneUpdates
+def grouped_sink(send):
+    def sink(batch):
+        send(group_changes([(entity.get('id'), change) for entity, change in batch]))
+        return [True] * len(batch)
+    return sink
+
+
+# Batch sink for transforms returning bulk changes (see changes.bulk_change)
+# The changes are queued with queue (e.g. StashInterface.queueSceneUpdate), so changes of the same entity are merged,
+# and sent by flush (StashInterface.flushUpdates) at the end of each batch
+def coalesced_sink(queue, flush):
+    def sink(batch):
+        errors = {}
+        for entity, change in batch:
+            errors.update(queue(entity, change))
+        errors.update(flush())
+        return [errors.get(str(entity.get('id')), True) for entity, _ in batch]
+    return sink
+
+
+# Yields the items of a paged query lazily
+# fetch_page(page) has to return the list of items of the given page (starting with 1)
+def paged(fetch_page, per_page):
+    page = 1
+    while True:
+        items = fetch_page(page)
+        yield from items
+        if len(items) < per_page:
+            return
+        page += 1
+
+
+# Bulk job consisting of a source, a transform function and a sink mutation
+#
+# source:     list or iterator of entities (dicts with an 'id'), iterators are consumed lazily
+# total:      number of entities of an iterator source, used for the progress
+# transform:  entity -> update or None, if there is nothing to do for this entity
+# sink:       update -> None, sends the mutation for a single update
+# batch_sink: [(entity, update)] -> [result], sends the mutations for a batch of updates. Results are True (updated),
+#             False (skipped) or an Exception (failed) for each item. Used instead of sink if set
+# workers:    number of parallel workers, None adjusts the number to the server load (see concurrency.py)
+# on_complete: called after all entities have been processed, before the checkpoint journal is closed
+#
+# The engine takes care of concurrency, progress, retries of failed mutations, checkpointing (see checkpoint.py)
+# and the time budget (see work_queue.py)
+# In dry run mode (see stash_interface.py) the updates are only logged and counted, nothing is checkpointed
+class BulkJob:
+    def __init__(self, name, source, transform, sink=None, batch_sink=None, workers=None, batch_size=1,
+                 checkpoint=True, budget=None, on_complete=None, total=None):
+        if sink is None and batch_sink is None:
+            raise ValueError("BulkJob requires a sink or a batch_sink")
+
+        self.name = name
+        self.source = source
+        self.transform = transform
+        self.sink = sink
+        self.batch_sink = batch_sink
+        self.workers = workers
+        self.batch_size = max(1, batch_size) if batch_sink is not None else 1
+        self.checkpoint = checkpoint
+        self.budget = budget if budget is not None else TimeBudget()
+        self.on_complete = on_complete
+        self.total = total
+        self.journal = None
+        self.stats = JobStats(name)
+
+        self.__controller = None
+        self.__lock = threading.Lock()
+        self.__batch = []
+        self.__total = 0
+        self.__progress = None
+        self.__error = None
+
+    def run(self):
+        start = time.time()
+        self.journal = Journal(self.name) if self.checkpoint and not stash_interface.dry_run else None
+        try:
+            # Entities done by a previous run don't count towards the total of an iterator source
+            entities = self.source
+            if self.journal is not None:
+                entities = self.journal.pending(self.source, on_skip=lambda: self.__progress.skip())
+            if self.total is not None:
+                self.__total = self.total
+            else:
+                self.__total = len(entities) if hasattr(entities, '__len__') else 0
+            self.__progress = ProgressReporter(self.__total, self.name)
+            self.__run(entities)
+            self.__progress.finish()
+            if self.__error is not None:
+                raise self.__error
+            if self.on_complete is not None:
+                self.on_complete()
+        except BaseException:
+            if self.journal is not None:
+                self.journal.close(completed=False)
+            raise
+        if self.journal is not None:
+            self.journal.close(completed=not self.stats.interrupted)
+
+        self.stats.elapsed = time.time() - start
+        metrics.record_job(self.stats)
+        log.LogInfo(str(self.stats))
+        return self.stats
+
+    def __run(self, entities):
+        if self.workers is None:
+            self.__controller = AIMDController()
+            nmb_threads = self.__controller.maximum
+        else:
+            nmb_threads = max(1, self.workers)
+        if hasattr(entities, '__len__'):
+            nmb_threads = min(nmb_threads, max(1, self.__total))
+
+        # Bounded, so the queue never holds more than a few entities per worker
+        q = Queue(maxsize=nmb_threads * 2)
+        threads = [
+            threading.Thread(target=self.__worker, name=f"{self.name}-{i}", args=(q,), daemon=True)
+            for i in range(nmb_threads)
+        ]
+        for thread in threads:
+            thread.start()
+
+        try:
+            for entity in entities:
+                if self.__error is not None:
+                    break
+                stop = self.budget.exhausted()
+                if not stop and cancellation.is_set():
+                    log.LogWarning(f"{self.name}: task cancelled, the remaining entities are left for the next run")
+                    stop = True
+                if stop:
+                    self.stats.interrupted = True
+                    if self.journal is not None:
+                        self.journal.interrupt()
+                    break
+                q.put(entity)
+        finally:
+            for _ in threads:
+                q.put(_STOP)
+            for thread in threads:
+                thread.join()
+
+        # Remaining items of an incomplete batch
+        if self.__error is None:
+            self.__flush_batch()
+
+    def __worker(self, q):
+        while True:
+            entity = q.get()
+            if entity is _STOP:
+                return
+            if self.__error is not None:
+                # Drain the queue after a fatal error
+                continue
+            try:
+                self.__process(entity)
+            except BaseException as e:
+                # Unexpected errors (e.g. sys.exit on authentication errors) abort the whole job
+                with self.__lock:
+                    if self.__error is None:
+                        self.__error = e
+
+    def __process(self, entity):
+        try:
+            update = self.transform(entity)
+        except Exception as e:
+            self.__failed(entity, e)
+            return
+
+        if update is None:
+            self.__finish(entity, False)
+        elif stash_interface.dry_run:
+            log.LogDebug(lambda: f"{self.name}: would update entity {entity.get('id')}: {update}")
+            self.__finish(entity, True)
+        elif self.batch_sink is not None:
+            with self.__lock:
+                self.__batch.append((entity, update))
+                full = len(self.__batch) >= self.batch_size
+            if full:
+                self.__flush_batch()
+        else:
+            try:
+                self.__with_retries(self.sink, update)
+            except Exception as e:
+                self.__failed(entity, e)
+                return
+            self.__finish(entity, True)
+
+    def __flush_batch(self):
+        with self.__lock:
+            batch = self.__batch
+            self.__batch = []
+        if not batch:
+            return
+
+        try:
+            results = self.__with_retries(self.batch_sink, batch)
+        except Exception as e:
+            results = [e] * len(batch)
+
+        for (entity, _), result in zip(batch, results):
+            if isinstance(result, Exception):
+                self.__failed(entity, result)
+            else:
+                self.__finish(entity, bool(result))
+
+    # Retries the mutation if the connection failed or the server was temporarily unavailable
+    def __with_retries(self, sink, payload):
+        for attempt in range(1, retries + 1):
+            try:
+                if self.__controller is not None:
+                    with self.__controller.slot():
+                        return sink(payload)
+                return sink(payload)
+            except Exception as e:
+                if attempt == retries or not stash_interface.is_transient(e):
+                    raise
+                log.LogWarning(f"{self.name}: request failed ({e}), retrying ({attempt}/{retries - 1})")
+                time.sleep(attempt)
+
+    def __failed(self, entity, error):
+        log.LogError(f"{self.name}: entity {entity.get('id')} failed: {error}")
+        with self.__lock:
+            if len(self.stats.errors) < max_errors:
+                self.stats.errors.append(f"{entity.get('id')}: {error}")
+        if self.journal is not None:
+            self.journal.failed(entity.get('id'))
+        self.__count('failed')
+
+    def __finish(self, entity, updated):
+        if self.journal is not None:
+            if updated:
+                self.journal.done(entity.get('id'))
+            else:
+                self.journal.skipped(entity.get('id'))
+        self.__count('updated' if updated else 'skipped')
+
+    def __count(self, counter):
+        with self.__lock:
+            setattr(self.stats, counter, getattr(self.stats, counter) + 1)
+            self.stats.scanned += 1
+        self.__progress.advance()
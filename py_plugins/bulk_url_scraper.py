@@ -1,3 +1,7 @@
+import plugin_worker
+if __name__ == '__main__':
+    plugin_worker.forward(__file__)
+
 import json
 import sys
 from urllib.parse import urlparse
@@ -6,8 +10,13 @@ import re
 import os
 
 import log
+import metrics
 import config
 from stash_interface import StashInterface
+from bulk_job import BulkJob, coalesced_sink
+from changes import add_relation, apply_change, bulk_change, changed_fields, diff_update, merge_changes, SCENE_PRESERVED_FIELDS
+from name_resolver import NameResolver
+from work_queue import ScrapeHistory
 
 # Name of the tag, that will be used for selecting scenes for bulk scraping
 try:
@@ -15,12 +24,16 @@ try:
 except AttributeError:
     control_tag = '0.Scrape'
 
+# Default for parse_performer_pattern in config.py
+default_parse_performer_pattern = r'^.*[ \._]([A-Z][a-zA-Z]+)[ \._]([A-Z][a-zA-Z]+)[ \._].*$'
+
 
 def main():
     json_input = read_json_input()
 
     output = {}
-    run(json_input, output)
+    with metrics.measure_run('bulk_url_scraper', json_input):
+        run(json_input, output)
 
     out = json.dumps(output)
     print(out + "\n")
@@ -65,7 +78,7 @@ def run(json_input, output):
     output["output"] = "ok"
 
 
-def __bulk_scrape(client, scenes, create_missing_performers=False, create_missing_tags=False, create_missing_studios=False, delay=5):
+def __bulk_scrape(client, scenes, covers, history, create_missing_performers=False, create_missing_tags=False, create_missing_studios=False, delay=5, batch_size=100, parse_performer=None):
     last_request = -1
     if delay > 0:
         # Initialize last request with current time + delay time
@@ -74,253 +87,269 @@ def __bulk_scrape(client, scenes, create_missing_performers=False, create_missin
         supported_scrapers = client.sceneScraperURLs()
     missing_scrapers = list()
 
-    # Number of scraped scenes
-    count = 0
-
-    total = len(scenes)
-    # Index for progress bar
-    i = 0
+    # Missing tags/performers/studios are created once for each batch of scraped scenes
+    resolver = NameResolver(client, create_missing_performers, create_missing_tags, create_missing_studios)
 
     # Scrape if url not in missing_scrapers
-    for scene in scenes:
-        # Update status bar
-        i += 1
-        log.LogProgress(i/total)
-
+    def scrape(scene):
         if scene.get('url') is None or scene.get('url') == "":
             log.LogInfo(f"Scene {scene.get('id')} is missing url")
-            continue
-        if urlparse(scene.get("url")).netloc not in missing_scrapers:
-            if delay:
-                wait(delay, last_request, time.time())
-            scraped_data = client.scrapeSceneURL(scene.get('url'))
-            if scraped_data is None:
-                if urlparse(scene.get('url')).netloc not in supported_scrapers:
-                    # If result is null, and url is not in list of supported scrapers, add url to missing_scrapers
-                    # Faster then checking every time, if url is in list of supported scrapers
-                    log.LogWarning(f"Scene {scene.get('id')}: Missing scraper for {urlparse(scene.get('url')).netloc}")
-                    log.LogDebug(f"Full url: {scene.get('url')}")
-                    missing_scrapers.append(urlparse(scene.get('url')).netloc)
-                continue
-            # No data has been found for this scene
-            if not any(scraped_data.values()):
-                log.LogInfo(f"Could not get data for scene {scene.get('id')}")
+            return None
+        if urlparse(scene.get("url")).netloc in missing_scrapers:
+            return None
+        if delay:
+            wait(delay, last_request, time.time())
+        scraped_data = client.scrapeSceneURL(scene.get('url'))
+        history.record(scene, scraped_data is not None and any(scraped_data.values()))
+        if scraped_data is None:
+            if urlparse(scene.get('url')).netloc not in supported_scrapers:
+                # If result is null, and url is not in list of supported scrapers, add url to missing_scrapers
+                # Faster then checking every time, if url is in list of supported scrapers
+                log.LogWarning(f"Scene {scene.get('id')}: Missing scraper for {urlparse(scene.get('url')).netloc}")
+                log.LogDebug(lambda: f"Full url: {scene.get('url')}")
+                missing_scrapers.append(urlparse(scene.get('url')).netloc)
+            return None
+        # No data has been found for this scene
+        if not any(scraped_data.values()):
+            log.LogInfo(f"Could not get data for scene {scene.get('id')}")
+            return None
+
+        resolver.collect(scraped_data, scene.get('url'))
+        return scraped_data
+
+    # Scraping is rate limited by the delay, scenes are scraped one after another
+    job = BulkJob(
+        'bulk_scrape', scenes, scrape,
+        batch_sink=lambda scraped: __update_scraped_scenes(client, scraped, resolver, covers, job.journal, parse_performer),
+        workers=1, batch_size=batch_size, on_complete=covers.close
+    )
+    return job.run()
+
+
+# Creates missing tags/performers/studios for the scraped scenes, then updates the scenes
+# parse_performer (see __performer_parser) adds the performer parsed from the filename, if set
+# Returns the result for each scene (see BulkJob)
+def __update_scraped_scenes(client, scraped, resolver, covers, journal, parse_performer=None):
+    try:
+        resolver.create_missing()
+    except Exception as e:
+        log.LogError(f"Could not create missing tags/performers/studios: {e}")
+        return [e] * len(scraped)
+
+    results = list()
+    errors = dict()
+    uploads = list()
+    for scene, scraped_data in scraped:
+        try:
+            # Only the fields that actually changed, scraped tags/performers replace the current ones
+            changes = [bulk_change(fields=changed_fields(scene, __scene_update(scene, scraped_data, resolver)))]
+            if parse_performer is not None:
+                changes.append(parse_performer(scene))
+            changes = [change for change in changes if change]
+
+            # Covers are uploaded separately, if they changed
+            image = scraped_data.get('image')
+            if image and covers.is_unchanged(scene, image):
+                image = None
+
+            if not changes and image is None:
+                log.LogDebug(lambda: f"Scene {scene.get('id')} is already up to date")
+                results.append(False)
                 continue
 
-            # Create dict with scene data
-            update_data = {
-                'id': scene.get('id')
-            }
-            if scraped_data.get('title'):
-                update_data['title'] = scraped_data.get('title')
-            if scraped_data.get('details'):
-                update_data['details'] = scraped_data.get('details')
-            if scraped_data.get('date'):
-                update_data['date'] = scraped_data.get('date')
-            if scraped_data.get('image'):
-                update_data['cover_image'] = scraped_data.get('image')
-            if scraped_data.get('tags'):
-                tag_ids = list()
-                for tag in scraped_data.get('tags'):
-                    if tag.get('stored_id'):
-                        tag_ids.append(tag.get('stored_id'))
-                    else:
-                        if create_missing_tags and tag.get('name') != "":
-                            # Capitalize each word
-                            tag_name = " ".join(x.capitalize() for x in tag.get('name').split(" "))
-                            log.LogInfo(f'Create missing tag: {tag_name}')
-                            tag_id = client.createTagWithName(tag_name)
-                            tag_ids.append(tag_id)
-                if len(tag_ids) > 0:
-                    update_data['tag_ids'] = tag_ids
-
-            if scraped_data.get('performers'):
-                performer_ids = list()
-                for performer in scraped_data.get('performers'):
-                    if performer.get('stored_id'):
-                        performer_ids.append(performer.get('stored_id'))
-                    else:
-                        if create_missing_performers and performer.get('name') != "":
-                            performer_name = " ".join(x.capitalize() for x in performer.get('name').split(" "))
-                            log.LogInfo(f'Create missing performer: {performer_name}')
-                            performer_id = client.createPerformerByName(performer_name)
-                            performer_ids.append(performer_id)
-                if len(performer_ids) > 0:
-                    update_data['performer_ids'] = performer_ids
-
-            if scraped_data.get('studio'):
-                studio = scraped_data.get('studio')
-                if studio.get('stored_id'):
-                    update_data['studio_id'] = studio.get('stored_id')
-                else:
-                    if create_missing_studios:
-                        studio_name = " ".join(x.capitalize() for x in studio.get('name').split(" "))
-                        log.LogInfo(f'Creating missing studio {studio_name}')
-                        studio_url = '{uri.scheme}://{uri.netloc}'.format(uri=urlparse(scene.get('url')))
-                        studio_id = client.createStudio(studio_name, studio_url)
-                        update_data['studio_id'] = studio_id
-
-            # Update scene with scraped scene data
-            client.updateScene(update_data)
-            log.LogDebug(f"Scraped data for scene {scene.get('id')}")
-            count += 1
-
-    return count
-
-def __bulk_scrape_scene_url(client, scenes, delay=5):
+            # Changes of the same scene are merged and sent as one update once per batch
+            for change in changes:
+                errors.update(client.queueSceneUpdate(scene, change))
+            if image:
+                # The cover upload has to keep the fields set by the metadata update
+                merged = changes[0] if changes else None
+                for change in changes[1:]:
+                    merged = merge_changes(merged, change)
+                uploads.append((scene, apply_change(scene, merged, SCENE_PRESERVED_FIELDS) if merged else None, image))
+            results.append(True)
+        except Exception as e:
+            results.append(e)
+    errors.update(client.flushUpdates())
+
+    # Covers are uploaded after the metadata, only for scenes whose metadata update succeeded
+    for scene, update_data, image in uploads:
+        if str(scene.get('id')) not in errors:
+            covers.upload(scene, update_data, image, journal.failed)
+
+    for i, (scene, _) in enumerate(scraped):
+        error = errors.get(str(scene.get('id')))
+        if error is not None:
+            results[i] = error
+        elif results[i] is True:
+            log.LogDebug(lambda: f"Scraped data for scene {scene.get('id')}")
+
+    return results
+
+
+# Create dict with scene data
+def __scene_update(scene, scraped_data, resolver):
+    update_data = {
+        'id': scene.get('id')
+    }
+    if scraped_data.get('title'):
+        update_data['title'] = scraped_data.get('title')
+    if scraped_data.get('details'):
+        update_data['details'] = scraped_data.get('details')
+    if scraped_data.get('date'):
+        update_data['date'] = scraped_data.get('date')
+
+    tag_ids = resolver.tag_ids(scraped_data)
+    if len(tag_ids) > 0:
+        update_data['tag_ids'] = tag_ids
+
+    performer_ids = resolver.performer_ids(scraped_data)
+    if len(performer_ids) > 0:
+        update_data['performer_ids'] = performer_ids
+
+    studio_id = resolver.studio_id(scraped_data)
+    if studio_id:
+        update_data['studio_id'] = studio_id
+
+    return update_data
+
+def __bulk_scrape_scene_url(client, scenes, history, scraper_ids, hedge_delay=2.0, delay=5):
     last_request = -1
     if delay > 0:
         # Initialize last request with current time + delay time
         last_request = time.time() + delay
 
-    # Number of scraped scenes
-    count = 0
-
-    total = len(scenes)
-    # Index for progress bar
-    i = 0
+    from hedging import HedgedSceneScraper
 
     # Scrape scene with existing metadata
-    for scene in scenes:
-        # Update status bar
-        i += 1
-        log.LogProgress(i/total)
-
-        if delay:
-            wait(delay, last_request, time.time())
-
-        # Create dict with scene data
-        scene_data = {
-            'id': scene.get('id'),
-        }
-
-        # Extract scraper ID if appended to control tag, then scrape scene
-        if '_' in control_tag:
-            scraper_id = control_tag.split('_')[-1]
-            scraped_data = client.scrapeScene(scene_data, scraper_id)
-        else:
-            scraped_data = client.scrapeScene(scene_data)
-
-        # No data has been found for this scene
-        if scraped_data is None or not any(scraped_data.values()):
-            log.LogInfo(f"Could not get data for scene {scene.get('id')}")
-            continue
+    with HedgedSceneScraper(client, scraper_ids, hedge_delay) as scraper:
+        def scrape(scene):
+            if delay:
+                wait(delay, last_request, time.time())
 
-        # Create dict with scene data
-        update_data = {
-            'id': scene.get('id')
-        }
-        if scraped_data.get('url'):
-            update_data['url'] = scraped_data.get('url')
+            # Create dict with scene data
+            scene_data = {
+                'id': scene.get('id'),
+            }
+            scraper_id, scraped_data = scraper.scrape(scene_data)
+            history.record(scene, scraped_data is not None)
 
-        # Update scene with scraped scene data
-        client.updateScene(update_data)
-        log.LogDebug(f"Scraped data for scene {scene.get('id')}")
-        count += 1
+            # No data has been found for this scene
+            if scraped_data is None:
+                log.LogInfo(f"Could not get data for scene {scene.get('id')}")
+                return None
+            log.LogDebug(lambda: f"Scraped data for scene {scene.get('id')} with {scraper_id}")
 
-    return count
+            # Create dict with scene data
+            update_data = {
+                'id': scene.get('id')
+            }
+            if scraped_data.get('url'):
+                update_data['url'] = scraped_data.get('url')
 
-def __bulk_create_performer(client, scenes, create_missing_performers, parse_performer_pattern, delay):
-    last_request = -1
-    if delay > 0:
-        # Initialize last request with current time + delay time
-        last_request = time.time() + delay
+            # Only send the fields that actually changed
+            return diff_update(scene, update_data, SCENE_PRESERVED_FIELDS)
 
-    # Number of created performers
-    count = 0
+        # Scraping is rate limited by the delay, scenes are scraped one after another
+        stats = BulkJob('bulk_scrape_scene_url', scenes, scrape, sink=client.updateScene, workers=1).run()
+        scraper.log_stats()
 
-    total = len(scenes)
-    # Index for progress bar
-    i = 0
+    return stats
 
-    # List all performers in database
-    all_performers = client.listPerformers()
+# Returns a function scene -> bulk change adding the performer parsed from the file name, or None
+def __performer_parser(client, create_missing_performers, parse_performer_pattern, similarity_threshold=0):
+    from performer_index import index_for
 
-    for scene in scenes:
-        # Update status bar
-        i += 1
-        log.LogProgress(i/total)
+    # Index of all performer names and aliases in database
+    performer_index = index_for(client.listPerformers(), similarity_threshold)
+    log.LogDebug(f"Indexed {len(performer_index)} performers")
+    performer_regex = re.compile(parse_performer_pattern)
 
+    def parse_performer(scene):
         if scene.get('path') is None or scene.get('path') == "":
             log.LogInfo(f"Scene {scene.get('id')} is missing path")
-            continue
+            return None
 
         # Parse performer name from scene basename file path
         scene_basename = os.path.basename(scene['path'])
-        log.LogInfo(f"Scene basename is: {scene_basename}")
-        performer_regex = re.compile(parse_performer_pattern)
+        log.LogDebug(lambda: f"Scene basename is: {scene_basename}")
         parsed_performer_regex = performer_regex.search(scene_basename)
         if parsed_performer_regex is None:
-            log.LogInfo(f"No Performer found Scene {scene.get('id')} filename")
-            continue
+            log.LogDebug(lambda: f"No Performer found Scene {scene.get('id')} filename")
+            return None
         parsed_performer_name = ' '.join(parsed_performer_regex.groups())
-        log.LogInfo(f"Parsed performer name is: {parsed_performer_name}")
+        log.LogDebug(lambda: f"Parsed performer name is: {parsed_performer_name}")
 
         # If performer name successfully parsed from scene basename
-        if parsed_performer_name:
-            # Create dict with scene data
-            update_data = {
-                'id': scene.get('id')
-            }
+        if not parsed_performer_name:
+            return None
 
-            # List all performers currently attached to scene
-            scene_performers = [sp['name'].lower() for sp in scene['performers']]
-            log.LogInfo(f"Current scene performers are: {scene_performers}")
+        # List all performers currently attached to scene
+        scene_performers = [sp['name'].lower() for sp in scene['performers']]
+        log.LogDebug(lambda: f"Current scene performers are: {scene_performers}")
 
-            # Check if performer already attached to scene
-            performer_ids = list()
-            if parsed_performer_name.lower() in scene_performers:
-                continue
-            else:
-                # Check if performer already exists in database
-                for performer in all_performers:
-                    if  performer['name'] and parsed_performer_name.lower() == performer['name'].lower():
-                        performer_ids.append(performer['id'])
-                        break
-                    if performer['aliases'] and parsed_performer_name.lower() in [p.strip().lower() for p in performer['aliases'].replace('/', ',').split(',')]:
-                        performer_ids.append(performer['id'])
-                        break
-                else:
-                    # Create performer if not in database
-                    if create_missing_performers and parsed_performer_name != "":
-                        performer_name = " ".join(x.capitalize() for x in parsed_performer_name.split(" "))
-                        log.LogInfo(f'Create missing performer: {performer_name}')
-                        performer_id = client.createPerformerByName(performer_name)
-                        performer_ids.append(performer_id)
-                        # Add newly created performer to all performers list
-                        all_performers.append({'id':performer_id, 'name':performer_name, 'aliases':''})
-
-                # Add found/created performer IDs to scene update data
-                if len(performer_ids) > 0:
-                    update_data['performer_ids'] = performer_ids
-                    log.LogInfo(f"Performer IDs found: {performer_ids}")
-
-                # Update scene with parsed performer data
-                client.updateScene(update_data)
-                log.LogDebug(f"Updated performer data for scene {scene.get('id')}")
-                count += 1
-
-    return count
-
-
-def bulk_scrape(client, create_missing_performers=False, create_missing_tags=False, create_missing_studios=False, delay=5):
+        # Check if performer already attached to scene
+        if parsed_performer_name.lower() in scene_performers:
+            return None
+
+        # Check if performer already exists in database
+        performer_id = performer_index.find(parsed_performer_name)
+        if performer_id is None and create_missing_performers:
+            # Create performer if not in database
+            performer_name = " ".join(x.capitalize() for x in parsed_performer_name.split(" "))
+            log.LogInfo(f'Create missing performer: {performer_name}')
+            performer_id = client.createPerformerByName(performer_name)
+            # Add newly created performer to the index
+            performer_index.add(performer_id, performer_name)
+
+        if performer_id is None:
+            return None
+        log.LogDebug(lambda: f"Performer ID found: {performer_id}")
+
+        # Add found/created performer ID to the performers of the scene
+        return add_relation(scene, 'performer_ids', [performer_id])
+
+    return parse_performer
+
+
+def __bulk_create_performer(client, scenes, create_missing_performers, parse_performer_pattern, delay, similarity_threshold=0):
+    parse_performer = __performer_parser(client, create_missing_performers, parse_performer_pattern, similarity_threshold)
+
+    # One worker, the performer index is updated while parsing
+    # Changes are merged with other pending changes of the same scene and sent once per batch
+    return BulkJob('bulk_create_performer', scenes, parse_performer,
+                   batch_sink=coalesced_sink(client.queueSceneUpdate, client.flushUpdates), workers=1,
+                   batch_size=client.scene_writes.max_pending).run()
+
+
+def bulk_scrape(client, create_missing_performers=False, create_missing_tags=False, create_missing_studios=False, delay=5, batch_size=100, cover_upload_workers=2, parse_performers=False, parse_performer_pattern=default_parse_performer_pattern, similarity_threshold=0):
     try:
         create_missing_studios = bool(config.create_missing_studios)
         create_missing_tags = bool(config.create_missing_tags)
         create_missing_performers = bool(config.create_missing_performers)
         delay = int(config.delay)
+        batch_size = int(config.scrape_batch_size)
+        cover_upload_workers = int(config.cover_upload_workers)
     except AttributeError as e:
         log.LogWarning(e)
         log.LogWarning("Using defaults for missing config values")
     except ValueError as e:
         log.LogWarning(e)
         log.LogWarning("Using defaults for wrong values")
+    try:
+        parse_performers = bool(config.parse_performers_on_scrape)
+        parse_performer_pattern = config.parse_performer_pattern
+        similarity_threshold = float(config.performer_similarity_threshold)
+    except (AttributeError, ValueError):
+        pass
 
     log.LogInfo('##### Bulk URL Scraper #####')
     log.LogInfo(f'create_missing_performers: {create_missing_performers}')
     log.LogInfo(f'create_missing_tags: {create_missing_tags}')
     log.LogInfo(f'create_missing_studios: {create_missing_studios}')
     log.LogInfo(f'delay: {delay}')
+    log.LogInfo(f'scrape_batch_size: {batch_size}')
+    log.LogInfo(f'cover_upload_workers: {cover_upload_workers}')
+    log.LogInfo(f'parse_performers_on_scrape: {parse_performers}')
     log.LogInfo('#############################')
 
     # Search for all scenes with scrape tag
@@ -331,13 +360,24 @@ def bulk_scrape(client, create_missing_performers=False, create_missing_tags=Fal
     tag_ids = [tag]
     scenes = client.findScenesByTags(tag_ids)
     log.LogInfo(f'Found {len(scenes)} scenes with scrape tag')
-    count = __bulk_scrape(client, scenes, create_missing_performers, create_missing_tags, create_missing_studios, delay)
-    log.LogInfo(f'Scraped data for {count} scenes')
-
-
-def bulk_scrape_scene_url(client, delay=5):
+    history = ScrapeHistory()
+    scenes = history.prioritize(scenes)
+    parse_performer = None
+    if parse_performers:
+        parse_performer = __performer_parser(client, create_missing_performers, parse_performer_pattern, similarity_threshold)
+    # Only loaded by the scrape task, it starts a thread pool for the uploads
+    from covers import CoverUploader
+    with CoverUploader(client, cover_upload_workers) as covers:
+        stats = __bulk_scrape(client, scenes, covers, history, create_missing_performers, create_missing_tags, create_missing_studios, delay, batch_size, parse_performer)
+    history.save()
+    log.LogInfo(f'Scraped data for {stats.updated} scenes')
+
+
+def bulk_scrape_scene_url(client, scraper_ids=None, hedge_delay=2.0, delay=5):
     try:
         delay = int(config.delay)
+        scraper_ids = list(config.scene_scrapers)
+        hedge_delay = float(config.scraper_hedge_delay)
     except AttributeError as e:
         log.LogWarning(e)
         log.LogWarning("Using defaults for missing config values")
@@ -345,7 +385,16 @@ def bulk_scrape_scene_url(client, delay=5):
         log.LogWarning(e)
         log.LogWarning("Using defaults for wrong values")
 
+    if not scraper_ids:
+        # Extract scraper ID if appended to control tag
+        if '_' in control_tag:
+            scraper_ids = [control_tag.split('_')[-1]]
+        else:
+            scraper_ids = ['ThePornDB']
+
     log.LogInfo('##### Bulk Scene URL Scraper #####')
+    log.LogInfo(f'scene_scrapers: {scraper_ids}')
+    log.LogInfo(f'scraper_hedge_delay: {hedge_delay}')
     log.LogInfo(f'delay: {delay}')
     log.LogInfo('#############################')
 
@@ -357,15 +406,19 @@ def bulk_scrape_scene_url(client, delay=5):
     tag_ids = [tag]
     scenes = client.findScenesByTags(tag_ids)
     log.LogInfo(f'Found {len(scenes)} scenes with scrape tag')
-    count = __bulk_scrape_scene_url(client, scenes, delay)
-    log.LogInfo(f'Scraped data for {count} scenes')
+    history = ScrapeHistory()
+    scenes = history.prioritize(scenes)
+    stats = __bulk_scrape_scene_url(client, scenes, history, scraper_ids, hedge_delay, delay)
+    history.save()
+    log.LogInfo(f'Scraped data for {stats.updated} scenes')
 
 
-def bulk_create_performer(client, create_missing_performers=False, parse_performer_pattern=r'^.*[ \._]([A-Z][a-zA-Z]+)[ \._]([A-Z][a-zA-Z]+)[ \._].*$', delay=5):
+def bulk_create_performer(client, create_missing_performers=False, parse_performer_pattern=default_parse_performer_pattern, delay=5, similarity_threshold=0):
     try:
         create_missing_performers = bool(config.create_missing_performers)
         parse_performer_pattern = config.parse_performer_pattern
         delay = int(config.delay)
+        similarity_threshold = float(config.performer_similarity_threshold)
     except AttributeError as e:
         log.LogWarning(e)
         log.LogWarning("Using defaults for missing config values")
@@ -376,6 +429,7 @@ def bulk_create_performer(client, create_missing_performers=False, parse_perform
     log.LogInfo('##### Bulk Create Performer #####')
     log.LogInfo(f'create_missing_performers: {create_missing_performers}')
     log.LogInfo(f'parse_performer_pattern: {parse_performer_pattern}')
+    log.LogInfo(f'performer_similarity_threshold: {similarity_threshold}')
     log.LogInfo(f'delay: {delay}')
     log.LogInfo('#############################')
 
@@ -387,8 +441,9 @@ def bulk_create_performer(client, create_missing_performers=False, parse_perform
     tag_ids = [tag]
     scenes = client.findScenesByTags(tag_ids)
     log.LogInfo(f'Found {len(scenes)} scenes with scrape tag')
-    count = __bulk_create_performer(client, scenes, create_missing_performers, parse_performer_pattern, delay)
-    log.LogInfo(f'Created {count} performers')
+    scenes = ScrapeHistory().prioritize(scenes)
+    stats = __bulk_create_performer(client, scenes, create_missing_performers, parse_performer_pattern, delay, similarity_threshold)
+    log.LogInfo(f'Created {stats.updated} performers')
 
 
 def add_tag(client):
@@ -412,4 +467,5 @@ def remove_tag(client):
     client.destroyTag(tag_id)
 
 
-main()
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+# Change detection for update mutations
+# Compares a proposed update (SceneUpdateInput, GalleryUpdateInput, ...) with the current values of the entity,
+# so no-op updates can be dropped and only changed fields have to be sent.
+
+# Fields that get cleared by the update mutations if they are omitted (see StashInterface.updateScene)
+# These have to be sent along with every update, even if they didn't change
+SCENE_PRESERVED_FIELDS = ('rating', 'studio_id', 'tag_ids', 'performer_ids', 'gallery_ids')
+GALLERY_PRESERVED_FIELDS = ('rating', 'studio_id', 'tag_ids', 'performer_ids')
+IMAGE_PRESERVED_FIELDS = ('rating', 'studio_id', 'tag_ids', 'performer_ids', 'gallery_ids')
+
+
+# Update input fields that refer to related entities and the matching field of the queried entity
+RELATION_FIELDS = {
+    'studio_id': 'studio',
+    'tag_ids': 'tags',
+    'performer_ids': 'performers',
+    'gallery_ids': 'galleries',
+    'scene_ids': 'scenes',
+}
+
+
+# Returns the current value of an update field from the entity returned by a query
+# e.g. tag_ids -> [t['id'] for t in entity['tags']], studio_id -> entity['studio']['id']
+# Returns None if the entity doesn't contain the field
+def current_value(entity, field):
+    if field not in RELATION_FIELDS:
+        return entity.get(field)
+    related = entity.get(RELATION_FIELDS[field])
+    if related is None:
+        return None
+    if field.endswith('_ids'):
+        return [r.get('id') for r in related]
+    return related.get('id')
+
+
+def __normalize(field, value):
+    if value is None or value == '' or value == []:
+        return None
+    # Relations are compared as sets of ids, the order returned by stash is not stable
+    if field.endswith('_ids'):
+        return frozenset(str(v) for v in value)
+    if field.endswith('_id'):
+        return str(value)
+    return value
+
+
+def is_changed(entity, field, value):
+    return __normalize(field, current_value(entity, field)) != __normalize(field, value)
+
+
+# Returns the minimal update for the entity or None, if the update wouldn't change anything
+# The result contains the id, all changed fields and the preserved fields, which would be cleared otherwise
+def diff_update(entity, update, preserved=()):
+    changed = changed_fields(entity, update)
+    if not changed:
+        return None
+
+    minimal = {'id': update.get('id', entity.get('id'))}
+    minimal.update(preserved_values(entity, update, preserved))
+    minimal.update(changed)
+    return minimal
+
+
+# Returns the fields of the update whose values differ from the entity
+def changed_fields(entity, update):
+    return {
+        field: value for field, value in update.items()
+        if field != 'id' and is_changed(entity, field, value)
+    }
+
+
+# Returns the values of the preserved fields after the update has been applied to the entity
+def preserved_values(entity, update, preserved):
+    values = {}
+    for field in preserved:
+        if update is not None and field in update:
+            values[field] = update[field]
+        else:
+            value = current_value(entity, field)
+            if value is not None:
+                values[field] = value
+    return values
+
+
+# Changes for the bulk update mutations (bulkSceneUpdate, bulkGalleryUpdate, ...)
+# Unlike the single update mutations, these leave omitted fields unchanged, so only the change itself is sent:
+# {'fields': {field: value}, 'add': {relation field: [ids]}, 'remove': {relation field: [ids]}}
+def bulk_change(fields=None, add=None, remove=None):
+    change = {}
+    if fields:
+        change['fields'] = fields
+    if add:
+        change['add'] = {field: ids for field, ids in add.items() if ids}
+    if remove:
+        change['remove'] = {field: ids for field, ids in remove.items() if ids}
+    return change if any(change.values()) else None
+
+
+# Returns the bulk change adding the ids to the relation of the entity, None if all are already there
+def add_relation(entity, field, ids):
+    current = __normalize(field, current_value(entity, field)) or frozenset()
+    missing = [i for i in ids if str(i) not in current]
+    return bulk_change(add={field: missing})
+
+
+def __bulk_input(ids, fields=None, relations=None, mode=None):
+    bulk_input = {'ids': sorted(ids, key=str)}
+    bulk_input.update(fields or {})
+    for field, relation_ids in (relations or {}).items():
+        bulk_input[field] = {'ids': list(relation_ids), 'mode': mode}
+    return bulk_input
+
+
+# Groups the changes of many entities into as few bulk update inputs as possible
+# changes: [(entity id, bulk change)]. Entities that get the same fields, or the same relation ids added or removed,
+# share one input, e.g. adding a tag to 5000 scenes becomes a single input with 5000 ids
+def group_changes(changes):
+    groups = {}
+    for entity_id, change in changes:
+        if change.get('fields'):
+            key = ('fields', tuple(sorted((f, repr(v)) for f, v in change['fields'].items())))
+            groups.setdefault(key, (change['fields'], None, None, []))[3].append(entity_id)
+        for mode in ('add', 'remove'):
+            if change.get(mode):
+                relations = {f: sorted(set(ids), key=str) for f, ids in change[mode].items()}
+                key = (mode, tuple((f, tuple(ids)) for f, ids in sorted(relations.items())))
+                groups.setdefault(key, (None, relations, mode.upper(), []))[3].append(entity_id)
+    return [__bulk_input(ids, fields, relations, mode) for fields, relations, mode, ids in groups.values()]
+
+
+def __without(ids, excluded):
+    excluded = set(str(i) for i in excluded or [])
+    return [i for i in ids or [] if str(i) not in excluded]
+
+
+def __union(ids, added):
+    merged = list(ids or [])
+    known = set(str(i) for i in merged)
+    for i in added or []:
+        if str(i) not in known:
+            known.add(str(i))
+            merged.append(i)
+    return merged
+
+
+# Merges two bulk changes of the same entity into one, None if nothing is left
+# Later fields win. Relation ids added or removed by either change are kept, unless the later change removes or adds
+# them again, or sets the whole relation as a field (e.g. fields={'tag_ids': [...]})
+def merge_changes(earlier, later):
+    later_fields = later.get('fields') or {}
+    fields = dict(earlier.get('fields') or {})
+    fields.update(later_fields)
+
+    add = {f: ids for f, ids in (earlier.get('add') or {}).items() if f not in later_fields}
+    remove = {f: ids for f, ids in (earlier.get('remove') or {}).items() if f not in later_fields}
+    for field, ids in (later.get('add') or {}).items():
+        add[field] = __union(add.get(field), ids)
+        remove[field] = __without(remove.get(field), ids)
+    for field, ids in (later.get('remove') or {}).items():
+        remove[field] = __union(remove.get(field), ids)
+        add[field] = __without(add.get(field), ids)
+    return bulk_change(fields, add, remove)
+
+
+# Returns the update input (SceneUpdateInput, ...) that applies the bulk change to the entity as it was fetched,
+# with the preserved fields, or None if the change doesn't change anything (see diff_update)
+# Relation ids are added to/removed from the relation set by the fields of the change or the current relation
+def apply_change(entity, change, preserved=()):
+    update = {'id': entity.get('id')}
+    update.update(change.get('fields') or {})
+    add = change.get('add') or {}
+    remove = change.get('remove') or {}
+    for field in set(add) | set(remove):
+        current = update[field] if field in update else current_value(entity, field)
+        update[field] = __union(__without(current, remove.get(field)), add.get(field))
+    return diff_update(entity, update, preserved)
@@ -0,0 +1,150 @@
+import json
+import os
+import threading
+
+import log
+import config
+import storage
+
+# Continue interrupted bulk runs where they stopped instead of starting over
+try:
+    resume_interrupted_runs = bool(config.resume_interrupted_runs)
+except AttributeError:
+    resume_interrupted_runs = True
+
+DONE = 'done'
+SKIPPED = 'skipped'
+FAILED = 'failed'
+
+
+# Append-only journal of processed entity ids for a single bulk task
+# Every line is a json object {"id": ..., "status": ...}. Entries are written in batches and synced to disk,
+# so after a crash at most one batch has to be processed again.
+# Once a run completes, the journal is rewritten with only the entities that failed, so the next run retries them
+# first and processes everything else again. It is removed if nothing failed.
+class Journal:
+    def __init__(self, task, resume=None, batch_size=50):
+        if resume is None:
+            resume = resume_interrupted_runs
+
+        self.task = task
+        self.path = storage.data_path(f'{task}.journal')
+        self.batch_size = batch_size
+        # Status of the entities processed by previous runs
+        self.status = {}
+        self.__buffer = []
+        # Entities that failed in this run
+        self.__failed = set()
+        self.__lock = threading.Lock()
+        # Set if the run stopped before all entities were processed
+        self.interrupted = False
+
+        if resume:
+            self.__load()
+        elif os.path.isfile(self.path):
+            os.remove(self.path)
+
+        self.__file = open(self.path, 'a')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Only forget the progress if the run actually finished
+        self.close(completed=exc_type is None and not self.interrupted)
+        return False
+
+    def __load(self):
+        if not os.path.isfile(self.path):
+            return
+        with open(self.path) as journal_file:
+            for line in journal_file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Last line might be incomplete if the process got killed while writing
+                    continue
+                self.status[str(entry['id'])] = entry['status']
+
+        if self.status:
+            counts = {DONE: 0, SKIPPED: 0, FAILED: 0}
+            for status in self.status.values():
+                counts[status] = counts.get(status, 0) + 1
+            log.LogInfo(f"Resuming {self.task}: {counts[DONE]} done, {counts[SKIPPED]} skipped, "
+                        f"{counts[FAILED]} failed in previous run")
+
+    # Returns the entities that still have to be processed
+    # Entities that failed in the previous run come first, entities that are done or skipped are dropped
+    # Iterators (e.g. lazily fetched pages) are filtered lazily, failed entities are not moved to the front
+    # and on_skip is called for every dropped entity
+    def pending(self, entities, on_skip=None):
+        if not isinstance(entities, (list, tuple)):
+            return self.__pending_lazily(entities, on_skip)
+
+        failed = []
+        remaining = []
+        for entity in entities:
+            status = self.status.get(str(entity.get('id')))
+            if status == FAILED:
+                failed.append(entity)
+            elif status is None:
+                remaining.append(entity)
+        if failed:
+            log.LogInfo(f"Retrying {len(failed)} failed entities from previous run first")
+        return failed + remaining
+
+    def __pending_lazily(self, entities, on_skip):
+        for entity in entities:
+            if self.status.get(str(entity.get('id'))) in (None, FAILED):
+                yield entity
+            elif on_skip is not None:
+                on_skip()
+
+    # Marks the run as unfinished, so the journal is kept for the next run
+    def interrupt(self):
+        self.interrupted = True
+
+    def done(self, entity_id):
+        self.__record(entity_id, DONE)
+
+    def skipped(self, entity_id):
+        self.__record(entity_id, SKIPPED)
+
+    def failed(self, entity_id):
+        self.__record(entity_id, FAILED)
+
+    def __record(self, entity_id, status):
+        # Only written to the file, so memory doesn't grow with the number of processed entities
+        with self.__lock:
+            if status == FAILED:
+                self.__failed.add(str(entity_id))
+            self.__buffer.append(json.dumps({'id': str(entity_id), 'status': status}))
+            if len(self.__buffer) >= self.batch_size:
+                self.__flush()
+
+    def flush(self):
+        with self.__lock:
+            self.__flush()
+
+    def __flush(self):
+        if not self.__buffer:
+            return
+        self.__file.write('\n'.join(self.__buffer) + '\n')
+        self.__file.flush()
+        os.fsync(self.__file.fileno())
+        self.__buffer = []
+
+    def close(self, completed=False):
+        with self.__lock:
+            if self.__file.closed:
+                return
+            self.__flush()
+            self.__file.close()
+            if not completed:
+                return
+            if self.__failed:
+                storage.write_atomic(self.path, ''.join(
+                    json.dumps({'id': entity_id, 'status': FAILED}) + '\n' for entity_id in sorted(self.__failed)
+                ))
+            else:
+                os.remove(self.path)
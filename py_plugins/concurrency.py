@@ -0,0 +1,78 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import log
+import config
+import stash_interface
+
+# Limits for the number of parallel requests of bulk mutation tasks
+# The actual number is adjusted during the run from the observed latency and error rate
+try:
+    min_workers = int(config.min_workers)
+    max_workers = int(config.max_workers)
+    target_latency = float(config.target_latency)
+except (AttributeError, ValueError):
+    min_workers = 1
+    max_workers = 16
+    target_latency = 1.0
+
+
+# Adaptive concurrency limit (additive increase, multiplicative decrease)
+# Every request has to acquire a slot. While requests finish faster than target_latency, the limit grows
+# by one per round of requests. Errors and slow requests halve the limit, at most once per round trip.
+class AIMDController:
+    def __init__(self, initial=None, minimum=None, maximum=None, target=None, decrease_factor=0.5):
+        self.minimum = max(1, minimum if minimum is not None else min_workers)
+        self.maximum = max(self.minimum, maximum if maximum is not None else max_workers)
+        self.target = target if target is not None else target_latency
+        self.decrease_factor = decrease_factor
+        self.limit = float(min(self.maximum, max(self.minimum, initial if initial is not None else self.minimum)))
+        self.active = 0
+        self.__last_decrease = 0.0
+        self.__condition = threading.Condition()
+        log.LogInfo(f"Concurrency: starting with {int(self.limit)} worker(s), max {self.maximum}, "
+                    f"target latency {self.target}s")
+
+    def acquire(self):
+        with self.__condition:
+            while self.active >= int(self.limit):
+                self.__condition.wait()
+            self.active += 1
+
+    def release(self, latency, error=False):
+        with self.__condition:
+            self.active -= 1
+            previous = int(self.limit)
+            now = time.time()
+            if error or latency > self.target:
+                # Requests started before the last decrease still see the old load, ignore them
+                if now - self.__last_decrease > latency:
+                    self.limit = max(self.minimum, self.limit * self.decrease_factor)
+                    self.__last_decrease = now
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+            if int(self.limit) > previous:
+                log.LogDebug(f"Concurrency: {previous} -> {int(self.limit)} worker(s)")
+            elif int(self.limit) < previous:
+                reason = 'error' if error else f'latency {latency:.2f}s'
+                log.LogInfo(f"Concurrency: {previous} -> {int(self.limit)} worker(s) ({reason})")
+            self.__condition.notify_all()
+
+    # Runs the enclosed request in a slot and measures its latency
+    @contextmanager
+    def slot(self):
+        self.acquire()
+        start = time.time()
+        error = False
+        try:
+            yield
+        except Exception as e:
+            # Timeouts, connection problems and 5xx/429 responses indicate an overloaded server, other errors
+            # (e.g. invalid inputs) say nothing about the load
+            error = stash_interface.is_transient(e)
+            raise
+        finally:
+            # Also on KeyboardInterrupt and SystemExit, so the slot isn't lost
+            self.release(time.time() - start, error=error)
@@ -7,9 +7,93 @@ create_missing_performers = False
 create_missing_tags = False
 create_missing_studios = False
 
+# Number of scenes that are scraped before missing performers/tags/studios are created
+# and the scenes get updated. Each missing name is only created once per run
+scrape_batch_size = 100  # Default: 100
+
+# Number of parallel cover uploads. Covers are uploaded after the metadata, and only if they changed
+cover_upload_workers = 2  # Default: 2
+
 # Regular expression pattern for matching performer 'First Last' name (seperated
 # with space, underscore or period) from filename.
 parse_performer_pattern = r'^.*[ \._]([A-Z][a-zA-Z]+)[ \._]([A-Z][a-zA-Z]*)[ \._].*$'
 
+# Match parsed performer names approximately against existing performer names and aliases,
+# e.g. 0.85 to match 'Jane Doee' with 'Jane Doe'. Value between 0 and 1, 0 disables approximate matching
+performer_similarity_threshold = 0  # Default: 0
+
+# Also add the performer parsed from the filename (see parse_performer_pattern) to the scenes of the scrape task.
+# The scraped data and the parsed performer are sent as a single update of the scene
+parse_performers_on_scrape = False  # Default: False
+
+# Ordered list of scraper ids used by the 'Scrape scenes url' task, e.g. ['ThePornDB', 'StashDB']
+# If empty, the scraper id appended to control_tag (e.g. '0.Scrape_ThePornDB') or ThePornDB is used
+scene_scrapers = []
+
+# Seconds to wait for a scraper before the next scraper in scene_scrapers is queried as well.
+# The first result with data is used. 0 queries all scrapers in parallel
+scraper_hedge_delay = 2.0  # Default: 2.0
+
 # Delay between web requests
 delay = 5  # Default: 5
+
+# Keep a journal of processed scenes/galleries/images for bulk tasks. If a task gets
+# interrupted, the next run skips everything that was already done and retries failed entries first
+resume_interrupted_runs = True  # Default: True
+
+# Maximum runtime of bulk tasks in minutes. Tasks stop cleanly once the time is up and
+# continue with the remaining scenes/galleries/images in the next run. 0 means no limit
+time_budget = 0  # Default: 0
+
+# Order in which the bulk scene tasks process scenes:
+# '' (order returned by stash), 'newest' (newest scenes first),
+# 'hit_rate' (domains with the highest scrape hit rate first), 'failed_last' (scenes that failed in previous runs last)
+scene_priority = ''  # Default: ''
+
+# Number of parallel requests for bulk update tasks. The number is adjusted automatically between
+# min_workers and max_workers: it grows while requests take less than target_latency seconds
+# and is halved on errors or slower requests
+min_workers = 1  # Default: 1
+max_workers = 16  # Default: 16
+target_latency = 1.0  # Default: 1.0
+
+# The 'Copy information to gallery' hooks copy the scene information to every created/updated gallery
+# (like 'Copy tags for all galleries') instead of only galleries with the CopyTags tag
+gallery_hook_copy_all_galleries = False  # Default: False
+
+# Run the plugin tasks in a resident worker process instead of starting a new python process for every task.
+# The worker keeps the loaded modules, the connection pool and cached tag/scraper lists between tasks.
+# It shuts down after plugin_worker_idle_timeout seconds without tasks and restarts once it uses more
+# than plugin_worker_max_memory_mb MB of memory. Only available on systems with unix sockets
+use_plugin_worker = False  # Default: False
+plugin_worker_idle_timeout = 600  # Default: 600
+plugin_worker_max_memory_mb = 512  # Default: 512
+
+# Minimum level of log messages sent to stash: 'trace', 'debug', 'info', 'warning' or 'error'.
+# Can be overridden with the STASH_PLUGIN_LOG_LEVEL environment variable
+log_level = 'trace'  # Default: 'trace'
+
+# Buffer log messages and send them every log_buffer_seconds seconds or once log_buffer_lines messages are
+# buffered, instead of one by one. Warnings and errors are always sent immediately. 0 disables the buffer
+log_buffer_seconds = 0  # Default: 0
+log_buffer_lines = 100  # Default: 100
+
+# Maximum number of progress updates per second sent to stash by bulk tasks
+progress_updates_per_second = 2  # Default: 2
+
+# Seconds between log lines with the throughput and estimated remaining time of bulk tasks. 0 disables them
+progress_info_interval = 30  # Default: 30
+
+# Number of images updated by a single bulk mutation ('Copy studio to images'). Larger studios are updated in chunks
+image_update_chunk_size = 1000  # Default: 1000
+
+# Number of studios processed in parallel by 'Copy studio to images'
+image_studio_copy_workers = 4  # Default: 4
+
+# Number of bulk updates sent in parallel by 'Copy tags and performers to images'
+image_tag_copy_workers = 4  # Default: 4
+
+# Folder for the metrics of the last run of every task (<plugin>_<mode>.prom in OpenMetrics text format and .json):
+# entity counts, requests and latency per operation, transferred bytes, cache hit rates and wall time.
+# Point it to the textfile collector folder of the node exporter to chart the runs. '' uses plugin_data/metrics
+metrics_dir = ''  # Default: ''
@@ -0,0 +1,119 @@
+import base64
+import binascii
+import hashlib
+import threading
+from queue import Queue
+
+import log
+import metrics
+import storage
+from changes import preserved_values, SCENE_PRESERVED_FIELDS
+
+# {scene_id: hash of the last cover uploaded by the plugins}
+cover_cache_file = 'cover_hashes.json'
+
+# Marks the end of the upload queue
+_STOP = object()
+
+
+# Hash of the decoded image, so different data uri prefixes for the same image don't matter
+def cover_hash(image):
+    data = image
+    if image.startswith('data:') and ',' in image:
+        try:
+            data = base64.b64decode(image.split(',', 1)[1])
+        except (binascii.Error, ValueError):
+            pass
+    if isinstance(data, str):
+        data = data.encode()
+    return hashlib.sha256(data).hexdigest()
+
+
+# Uploads scene covers in a separate stage with its own worker threads
+# Uploads run in the background after the metadata of the scene has been updated, so metadata updates don't have to
+# wait behind the large cover requests. The queue is bounded like the one of BulkJob, producers wait if the uploads
+# fall behind. Covers which are identical to the last uploaded cover of the scene are skipped.
+class CoverUploader:
+    def __init__(self, client, workers=2):
+        self.client = client
+        self.uploaded = 0
+        self.unchanged = 0
+        self.failed = 0
+        self.__hashes = storage.load_json(cover_cache_file, {})
+        self.__lock = threading.Lock()
+        self.__closed = False
+
+        workers = max(1, workers)
+        self.__queue = Queue(maxsize=workers * 2)
+        self.__threads = [
+            threading.Thread(target=self.__worker, name=f"CoverUpload-{i}", daemon=True) for i in range(workers)
+        ]
+        for thread in self.__threads:
+            thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    # True if the cover is identical to the last cover uploaded for this scene
+    def is_unchanged(self, scene, image):
+        with self.__lock:
+            unchanged = self.__hashes.get(str(scene.get('id'))) == cover_hash(image)
+            if unchanged:
+                self.unchanged += 1
+        metrics.record_cache('covers', unchanged)
+        return unchanged
+
+    # Queues the cover upload for the scene, has to be called after the metadata update of the scene was sent
+    # update is the metadata update sent for the scene (or None), the preserved fields are taken from the scene
+    # as it is after that update
+    # on_error is called with the scene id if the upload fails
+    def upload(self, scene, update, image, on_error=None):
+        # Rating, tags, ... would be cleared otherwise
+        cover_data = {'id': scene.get('id')}
+        cover_data.update(preserved_values(scene, update, SCENE_PRESERVED_FIELDS))
+        cover_data['cover_image'] = image
+
+        self.__queue.put((str(scene.get('id')), cover_data, cover_hash(image), on_error))
+
+    def __worker(self):
+        while True:
+            item = self.__queue.get()
+            if item is _STOP:
+                return
+            self.__upload(*item)
+
+    def __upload(self, scene_id, cover_data, image_hash, on_error):
+        try:
+            self.client.updateScene(cover_data)
+        except Exception as e:
+            log.LogError(f"Cover upload for scene {scene_id} failed: {e}")
+            with self.__lock:
+                self.failed += 1
+            if on_error is not None:
+                on_error(scene_id)
+            return
+        # Only covers that are actually stored in stash count as unchanged in later runs
+        with self.__lock:
+            self.__hashes[scene_id] = image_hash
+            self.uploaded += 1
+        log.LogDebug(lambda: f"Uploaded cover for scene {scene_id}")
+
+    # Waits for all queued uploads and stores the hash cache
+    def close(self):
+        with self.__lock:
+            if self.__closed:
+                return
+            self.__closed = True
+        for _ in self.__threads:
+            self.__queue.put(_STOP)
+        for thread in self.__threads:
+            thread.join()
+        with self.__lock:
+            storage.save_json(cover_cache_file, self.__hashes)
+        if self.uploaded or self.unchanged or self.failed:
+            log.LogInfo(f"Uploaded {self.uploaded} cover(s), skipped {self.unchanged} unchanged cover(s), "
+                        f"{self.failed} failed")
@@ -1,18 +1,40 @@
+import plugin_worker
+if __name__ == '__main__':
+    plugin_worker.forward(__file__)
+
+import hashlib
 import json
 import sys
-import time
+import threading
+from datetime import datetime, timezone
 
 import log
+import metrics
+import config
+import storage
+import stash_interface
 from stash_interface import StashInterface
+from bulk_job import BulkJob
+from changes import diff_update, is_changed, GALLERY_PRESERVED_FIELDS
 
 # Name of the tag used by this plugin
 control_tag = "CopyTags"
 
+# Time of the last successful copy to all galleries, the incremental copy only handles changes after it
+watermark_file = 'copy_all_tags_watermark.json'
+
+# Copy the scene information to every gallery affected by a hook, not only to galleries with the CopyTags tag
+try:
+    hook_copy_all_galleries = bool(config.gallery_hook_copy_all_galleries)
+except AttributeError:
+    hook_copy_all_galleries = False
+
 def main():
     json_input = read_json_input()
 
     output = {}
-    run(json_input, output)
+    with metrics.measure_run('gallerytags', json_input):
+        run(json_input, output)
 
     out = json.dumps(output)
     print(out + "\n")
@@ -24,10 +46,14 @@ def read_json_input():
 
 
 def run(json_input, output):
-    mode_arg = json_input['args']['mode']
+    hook_context = json_input['args'].get('hookContext')
+    mode_arg = json_input['args'].get('mode', '')
 
     try:
-        if mode_arg == "" or mode_arg == "create":
+        if hook_context:
+            client = StashInterface(json_input["server_connection"])
+            copy_tags_hook(client, hook_context)
+        elif mode_arg == "" or mode_arg == "create":
             client = StashInterface(json_input["server_connection"])
             add_tag(client)
         elif mode_arg == "remove":
@@ -39,51 +65,104 @@ def run(json_input, output):
         elif mode_arg == "copyall":
             client = StashInterface(json_input["server_connection"])
             copy_all_tags(client)
+        elif mode_arg == "copyallincremental":
+            client = StashInterface(json_input["server_connection"])
+            copy_changed_tags(client)
+        elif mode_arg == "copyallpreview":
+            client = StashInterface(json_input["server_connection"])
+            preview_copy_all_tags(client)
         elif mode_arg == "studioImageCopy":
             client = StashInterface(json_input["server_connection"])
             image_studio_copy(client)
+        elif mode_arg == "tagImageCopy":
+            client = StashInterface(json_input["server_connection"])
+            image_tags_copy(client)
     except Exception:
         raise
 
     output["output"] = "ok"
 
 
+# Returns the update for the gallery with the information of its first scene or None
+def __gallery_update(client, gallery):
+    if not gallery.get('scenes'):
+        return None
+    if len(gallery.get('scenes')) > 1:
+        log.LogInfo(f'Gallery {gallery.get("id")} has multiple scenes, only copying tags from first scene')
+
+    # Select first scene from gallery scenes
+    # The gallery queries include the scene fields, only fetch the scene if they are missing
+    scene = gallery.get('scenes')[0]
+    if 'title' not in scene:
+        scene = client.getSceneById(scene.get('id'))
+    gallery_data = {
+        'id': gallery.get('id'),
+        'title': scene.get('title')
+    }
+    if scene.get('details'):
+        gallery_data['details'] = scene.get('details')
+    if scene.get('url'):
+        gallery_data['url'] = scene.get('url')
+    if scene.get('date'):
+        gallery_data['date'] = scene.get('date')
+    if scene.get('rating'):
+        gallery_data['rating'] = scene.get('rating')
+    if scene.get('studio'):
+        gallery_data['studio_id'] = scene.get('studio').get('id')
+    if scene.get('tags'):
+        tag_ids = [t.get('id') for t in scene.get('tags')]
+        gallery_data['tag_ids'] = tag_ids
+    if scene.get('performers'):
+        performer_ids = [p.get('id') for p in scene.get('performers')]
+        gallery_data['performer_ids'] = performer_ids
+
+    # Skip galleries that are already in sync with their scene
+    return diff_update(gallery, gallery_data, GALLERY_PRESERVED_FIELDS)
+
+
 # Helper function
-def __copy_tags(client, galleries):
-    # TODO: Multithreading
-    count = 0
-    for gallery in galleries:
-        if gallery.get('scenes') is not None:
-            if len(gallery.get('scenes')) > 1:
-                log.LogInfo(f'Gallery {gallery.get("id")} has multiple scenes, only copying tags from first scene')
-            # Select first scene from gallery scenes
-            scene_id = gallery.get('scenes')[0].get('id')
-            scene = client.getSceneById(scene_id)
-            gallery_data = {
-                'id': gallery.get('id'),
-                'title': scene.get('title')
-            }
-            if scene.get('details'):
-                gallery_data['details'] = scene.get('details')
-            if scene.get('url'):
-                gallery_data['url'] = scene.get('url')
-            if scene.get('date'):
-                gallery_data['date'] = scene.get('date')
-            if scene.get('rating'):
-                gallery_data['rating'] = scene.get('rating')
-            if scene.get('studio'):
-                gallery_data['studio_id'] = scene.get('studio').get('id')
-            if scene.get('tags'):
-                tag_ids = [t.get('id') for t in scene.get('tags')]
-                gallery_data['tag_ids'] = tag_ids
-            if scene.get('performers'):
-                performer_ids = [p.get('id') for p in scene.get('performers')]
-                gallery_data['performer_ids'] = performer_ids
+def __copy_tags(client, galleries, name):
+    return BulkJob(name, galleries, lambda gallery: __gallery_update(client, gallery), sink=client.updateGallery).run()
+
+
+def __save_watermark(started, stats):
+    if stash_interface.dry_run:
+        return
+    # Galleries that failed or weren't processed have to be handled by the next run
+    if stats.failed or stats.interrupted:
+        log.LogInfo("Not all galleries were updated, the next incremental run checks the same changes again")
+        return
+    storage.save_json(watermark_file, {'updated_at': started})
+
+
+# Called by the gallery and scene hooks, copies the scene information to the affected galleries only
+def copy_tags_hook(client, hook_context):
+    hook_type = hook_context.get('type', '')
+    if hook_type.startswith('Scene.'):
+        scene = client.getSceneById(hook_context.get('id'))
+        gallery_ids = [g.get('id') for g in scene.get('galleries')] if scene else []
+    else:
+        gallery_ids = [hook_context.get('id')]
+    if not gallery_ids:
+        return
 
+    tag = None
+    if not hook_copy_all_galleries:
+        tag = client.findTagIdWithName(control_tag)
+        if tag is None:
+            return
+
+    for gallery_id in gallery_ids:
+        gallery = client.getGalleryById(gallery_id)
+        if gallery is None:
+            continue
+        # Only galleries with the CopyTags tag, unless enabled for all galleries
+        if tag is not None and tag not in [t.get('id') for t in gallery.get('tags')]:
+            continue
+        gallery_data = __gallery_update(client, gallery)
+        if gallery_data is not None:
             client.updateGallery(gallery_data)
-            log.LogDebug(f'Copied information to gallery {gallery.get("id")}')
-            count += 1
-    return count
+            log.LogInfo(f'Copied information to gallery {gallery_id}')
 
 
 def copy_tags(client):
@@ -97,29 +176,77 @@ def copy_tags(client):
 
     log.LogDebug(f"Found {len(galleries)} galleries with {control_tag} tag")
 
-    count = __copy_tags(client, galleries)
+    stats = __copy_tags(client, galleries, 'copy_tags')
 
-    log.LogInfo(f'Copied scene information to {count} galleries')
+    log.LogInfo(f'Copied scene information to {stats.updated} galleries')
 
 
+# Full rebuild, copies the scene information to all galleries
 def copy_all_tags(client):
-    log.LogWarning("#######################################")
-    log.LogWarning("Warning! This task will copy all information to all galleries with attached scenes")
-    log.LogWarning("You have 30 seconds to cancel this task before it starts copying")
-    log.LogWarning("#######################################")
-
-    time.sleep(30)
+    started = datetime.now(timezone.utc).isoformat(timespec='seconds')
     log.LogInfo("Start copying information. This may take a while depending on the amount of galleries")
     # Get all galleries
     galleries = client.findGalleriesByTags([])
     log.LogDebug(f"Found {len(galleries)} galleries")
-    count = __copy_tags(client, galleries)
+    stats = __copy_tags(client, galleries, 'copy_all_tags')
+    __save_watermark(started, stats)
+
+    log.LogInfo(f'Copied scene information to {stats.updated} galleries')
+
+
+# Only copies the scene information to galleries that changed or whose scenes changed since the last run
+def copy_changed_tags(client):
+    watermark = storage.load_json(watermark_file, {}).get('updated_at')
+    if watermark is None:
+        log.LogInfo("No previous run found, copying information to all galleries")
+        copy_all_tags(client)
+        return
+
+    started = datetime.now(timezone.utc).isoformat(timespec='seconds')
+    log.LogInfo(f"Copying information of galleries and scenes changed since {watermark}")
+    galleries = {gallery.get('id'): gallery for gallery in client.findGalleriesUpdatedSince(watermark)}
+    scene_ids = client.findSceneIdsUpdatedSince(watermark)
+    log.LogDebug(f"Found {len(galleries)} changed galleries and {len(scene_ids)} changed scenes")
+    for gallery in client.findGalleriesBySceneIds(scene_ids) if scene_ids else []:
+        galleries[gallery.get('id')] = gallery
+
+    stats = __copy_tags(client, list(galleries.values()), 'copy_changed_tags')
+    __save_watermark(started, stats)
 
-    log.LogInfo(f'Copied scene information to {count} galleries')
+    log.LogInfo(f'Copied scene information to {stats.updated} of {len(galleries)} changed galleries')
 
 
-def image_studio_copy(client):
-    galleries = client.findGalleries()
+# Reports what 'Copy tags for all galleries' would change, without changing anything
+def preview_copy_all_tags(client):
+    galleries = client.findGalleriesByTags([])
+    with_scenes = [gallery for gallery in galleries if gallery.get('scenes')]
+
+    changed_fields = {}
+    count = 0
+    for gallery in with_scenes:
+        gallery_data = __gallery_update(client, gallery)
+        if gallery_data is None:
+            continue
+        count += 1
+        # The update also contains the preserved fields, only count fields that actually change
+        for field, value in gallery_data.items():
+            if field != 'id' and is_changed(gallery, field, value):
+                changed_fields[field] = changed_fields.get(field, 0) + 1
+
+    log.LogInfo(f'{count} of {len(with_scenes)} galleries with scenes would be changed ({len(galleries)} galleries in total)')
+    for field, field_count in sorted(changed_fields.items(), key=lambda item: -item[1]):
+        log.LogInfo(f'{field}: {field_count} galleries')
+
+
+def image_studio_copy(client, chunk_size=1000, workers=4):
+    try:
+        chunk_size = int(config.image_update_chunk_size)
+        workers = int(config.image_studio_copy_workers)
+    except (AttributeError, ValueError):
+        pass
+
+    # Only galleries with a studio
+    galleries = client.findGalleries({'studios': {'value': [], 'modifier': 'NOT_NULL'}})
 
     # List of gallery ids for each studio
     # {'studio_id': [gallery_ids]}
@@ -129,35 +256,98 @@ def image_studio_copy(client):
     for gallery in galleries:
         studio = gallery.get('studio')
         if studio is not None:
-            if studio_mapping.get(studio.get('id')):
-                studio_mapping[studio.get('id')].append(int(gallery.get('id')))
-            else:
-                studio_mapping[studio.get('id')] = [int(gallery.get('id'))]
+            studio_mapping.setdefault(studio.get('id'), []).append(gallery.get('id'))
 
     log.LogDebug(f'Found {len(studio_mapping)} studios with galleries')
-
-    # Bulk update all images in galleries for each studio
-    for studio, galleries in studio_mapping.items():
-        studio_id = int(studio)
-        log.LogDebug(f'There are {len(galleries)} galleries with studio id {studio_id}')
-
-        # Get images with gallery ids
-        image_filter = {
-            "galleries": {
-                "value": galleries,
-                "modifier": "INCLUDES"
+    studios = [{'id': studio_id, 'galleries': gallery_ids} for studio_id, gallery_ids in studio_mapping.items()]
+
+    # Returns the ids of the images in the galleries of the studio, that have no or a different studio
+    def images_to_update(studio):
+        image_ids = []
+        # Studios with many galleries are queried in chunks as well, to keep the filter small
+        for i in range(0, len(studio['galleries']), chunk_size):
+            image_filter = {
+                "galleries": {
+                    "value": studio['galleries'][i:i + chunk_size],
+                    "modifier": "INCLUDES"
+                },
+                "studios": {
+                    "value": [studio['id']],
+                    "modifier": "EXCLUDES"
+                }
             }
-        }
+            image_ids += client.findImageIds(image_filter)
+        if not image_ids:
+            return None
+        log.LogInfo(f'Adding studio {studio["id"]} to {len(image_ids)} images')
+        return {'studio_id': studio['id'], 'image_ids': image_ids}
 
-        images = client.findImages(image_filter)
-        log.LogDebug(f'There is a total of {len(images)} images with studio id {studio_id}')
+    # Bulk update the images in chunks, a single mutation for all images of large studios times out
+    def update_images(update):
+        image_ids = update['image_ids']
+        for i in range(0, len(image_ids), chunk_size):
+            client.updateImageStudio(image_ids=image_ids[i:i + chunk_size], studio_id=update['studio_id'])
 
-        # Only update images with no studio or different studio
-        to_update = [int(image.get('id')) for image in images if (image.get('studio') is None or int(image.get('studio').get('id')) != studio_id)]
-        log.LogInfo(f'Adding studio {studio_id} to {len(to_update)} images')
+    stats = BulkJob('image_studio_copy', studios, images_to_update, sink=update_images, workers=workers).run()
+    log.LogInfo(f'Updated images of {stats.updated} studios')
 
-        # Bulk update images with studio_id
-        client.updateImageStudio(image_ids=to_update, studio_id=studio_id)
+
+# Adds the tags and performers of each gallery to its images
+def image_tags_copy(client, chunk_size=1000, workers=4):
+    try:
+        chunk_size = int(config.image_update_chunk_size)
+        workers = int(config.image_tag_copy_workers)
+    except (AttributeError, ValueError):
+        pass
+
+    # The control tag is only meant for galleries
+    control_tag_id = client.findTagIdWithName(control_tag)
+
+    # Galleries whose images receive the same tags and performers are updated together
+    # {(tag_ids, performer_ids): [gallery_ids]}
+    groups = {}
+    for gallery in client.findGalleries():
+        tag_ids = tuple(sorted(t.get('id') for t in gallery.get('tags') if t.get('id') != control_tag_id))
+        performer_ids = tuple(sorted(p.get('id') for p in gallery.get('performers')))
+        if tag_ids or performer_ids:
+            groups.setdefault((tag_ids, performer_ids), []).append(gallery.get('id'))
+
+    log.LogDebug(f'Found {sum(len(g) for g in groups.values())} galleries with {len(groups)} different tag/performer combinations')
+    additions = [
+        {'id': __group_key(tag_ids, performer_ids), 'tag_ids': list(tag_ids),
+         'performer_ids': list(performer_ids), 'galleries': gallery_ids}
+        for (tag_ids, performer_ids), gallery_ids in groups.items()
+    ]
+
+    def images_to_update(addition):
+        image_ids = []
+        for i in range(0, len(addition['galleries']), chunk_size):
+            image_filter = {"galleries": {"value": addition['galleries'][i:i + chunk_size], "modifier": "INCLUDES"}}
+            image_ids += client.findImageIds(image_filter)
+        if not image_ids:
+            return None
+        return dict(addition, image_ids=image_ids)
+
+    # Number of bulkImageUpdate mutations sent by all workers
+    mutations = [0]
+    lock = threading.Lock()
+
+    def update_images(update):
+        image_ids = update['image_ids']
+        for i in range(0, len(image_ids), chunk_size):
+            client.bulkImageUpdate(image_ids[i:i + chunk_size], update['tag_ids'], update['performer_ids'], mode='ADD')
+            with lock:
+                mutations[0] += 1
+
+    BulkJob('image_tags_copy', additions, images_to_update, sink=update_images, workers=workers).run()
+    log.LogInfo(f'Copied tags and performers of {sum(len(a["galleries"]) for a in additions)} galleries '
+                f'to their images with {mutations[0]} bulk updates')
+
+
+# Journal key of a tag/performer combination, short and independent of the order of the ids
+def __group_key(tag_ids, performer_ids):
+    ids = json.dumps([sorted(tag_ids), sorted(performer_ids)])
+    return hashlib.sha1(ids.encode()).hexdigest()
 
 
 def add_tag(client):
@@ -183,4 +373,5 @@ def remove_tag(client):
     client.destroyTag(tag_id)
 
 
-main()
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import log
+
+
+# Success and latency statistics of a single scraper
+class ScraperStats:
+    def __init__(self):
+        self.requests = 0
+        self.hits = 0
+        self.errors = 0
+        self.wins = 0
+        self.total_latency = 0.0
+
+    def __str__(self):
+        average = self.total_latency / self.requests if self.requests else 0
+        return (f"{self.requests} requests, {self.hits} hits, {self.wins} used, {self.errors} errors, "
+                f"avg latency {average:.2f}s")
+
+
+# Scrapes scenes with an ordered list of scrapers and returns the first non-empty result
+# The first scraper is queried immediately. If it didn't answer within hedge_delay seconds (or answered
+# without data), the next scraper is started as well. With hedge_delay <= 0 all scrapers are queried in parallel.
+class HedgedSceneScraper:
+    def __init__(self, client, scraper_ids, hedge_delay=2.0):
+        self.client = client
+        self.scraper_ids = list(scraper_ids)
+        self.hedge_delay = hedge_delay
+        self.stats = {scraper_id: ScraperStats() for scraper_id in self.scraper_ids}
+        self.__lock = threading.Lock()
+        # Slow scrapers of the previous scene might still be running, don't let them block the next scene
+        self.__executor = ThreadPoolExecutor(max_workers=2 * len(self.scraper_ids), thread_name_prefix='Scraper')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def __scrape(self, scraper_id, scene_data):
+        stats = self.stats[scraper_id]
+        start = time.time()
+        try:
+            result = self.client.scrapeScene(scene_data, scraper_id)
+        except Exception as e:
+            with self.__lock:
+                stats.requests += 1
+                stats.errors += 1
+                stats.total_latency += time.time() - start
+            log.LogDebug(lambda: f"Scraper {scraper_id} failed for scene {scene_data.get('id')}: {e}")
+            return None
+
+        found = result is not None and any(result.values())
+        with self.__lock:
+            stats.requests += 1
+            stats.total_latency += time.time() - start
+            if found:
+                stats.hits += 1
+        return result if found else None
+
+    # Returns (scraper_id, scraped_data) of the first scraper with data or (None, None)
+    def scrape(self, scene_data):
+        remaining = list(self.scraper_ids)
+        pending = {}
+
+        def start_next():
+            scraper_id = remaining.pop(0)
+            pending[self.__executor.submit(self.__scrape, scraper_id, scene_data)] = scraper_id
+
+        start_next()
+        while remaining and self.hedge_delay <= 0:
+            start_next()
+
+        while pending:
+            done, _ = wait(pending, timeout=self.hedge_delay if remaining else None, return_when=FIRST_COMPLETED)
+            if not done:
+                # Hedge: first scraper is too slow, start the next one
+                start_next()
+                continue
+            for future in done:
+                scraper_id = pending.pop(future)
+                result = future.result()
+                if result is not None:
+                    # Slower scrapers keep running in the background, their results are ignored
+                    for other in pending:
+                        other.cancel()
+                    with self.__lock:
+                        self.stats[scraper_id].wins += 1
+                    return scraper_id, result
+            # No data from the finished scraper(s), don't wait for the hedge delay
+            if remaining:
+                start_next()
+        return None, None
+
+    def log_stats(self):
+        for scraper_id, stats in self.stats.items():
+            log.LogInfo(f"Scraper {scraper_id}: {stats}")
+
+    def close(self):
+        self.__executor.shutdown(wait=True)
@@ -1,4 +1,10 @@
+import atexit
+import os
 import sys
+import threading
+import time
+
+import config
 
 
 # Log messages sent from a plugin instance are transmitted via stderr and are
@@ -11,6 +17,32 @@ import sys
 # formatted methods are intended for use by plugin instances to transmit log
 # messages. The LogProgress method is also intended for sending progress data.
 #
+# Messages below the minimum level (STASH_PLUGIN_LOG_LEVEL or log_level in config.py) are dropped. Instead of a string,
+# a function returning the message can be passed, it is only called if the message is actually logged.
+#
+# With log_buffer_seconds > 0, messages are buffered and written every log_buffer_seconds or once
+# log_buffer_lines messages are buffered. Warnings and errors are always written immediately.
+#
+
+LEVELS = {'trace': 0, 'debug': 1, 'info': 2, 'warning': 3, 'error': 4}
+__level_chars = {b't': 0, b'd': 1, b'i': 2, b'w': 3, b'e': 4, b'p': 4}
+
+
+def __config(name, default, convert):
+    try:
+        return convert(getattr(config, name))
+    except (AttributeError, ValueError):
+        return default
+
+
+min_level = LEVELS.get(str(os.environ.get('STASH_PLUGIN_LOG_LEVEL') or __config('log_level', 'trace', str)).lower(), 0)
+buffer_seconds = __config('log_buffer_seconds', 0, float)
+buffer_lines = __config('log_buffer_lines', 100, int)
+
+__buffer = []
+__lock = threading.Lock()
+__flusher = None
+
 
 def __prefix(level_char):
     start_level_char = b'\x01'
@@ -20,11 +52,61 @@ def __prefix(level_char):
     return ret.decode()
 
 
+def is_enabled(level_char):
+    return __level_chars.get(level_char, 0) >= min_level
+
+
 def __log(level_char, s):
-    if level_char == "":
+    if level_char == "" or not is_enabled(level_char):
+        return
+    if callable(s):
+        s = s()
+
+    line = __prefix(level_char) + str(s) + "\n"
+    if buffer_seconds <= 0:
+        print(line, file=sys.stderr, flush=True)
+        return
+
+    with __lock:
+        if level_char == b'p' and __buffer and __buffer[-1][0] == b'p':
+            # Only the latest progress is of interest
+            __buffer[-1] = (level_char, line)
+        else:
+            __buffer.append((level_char, line))
+        if level_char in (b'w', b'e') or len(__buffer) >= buffer_lines:
+            __flush()
+        else:
+            __start_flusher()
+
+
+# Writes all buffered messages
+def flush():
+    with __lock:
+        __flush()
+
+
+def __flush():
+    if not __buffer:
         return
+    print('\n'.join(line for _, line in __buffer), file=sys.stderr, flush=True)
+    __buffer.clear()
+
+
+def __start_flusher():
+    global __flusher
+    if __flusher is not None:
+        return
+
+    def flush_periodically():
+        while True:
+            time.sleep(buffer_seconds)
+            flush()
+
+    __flusher = threading.Thread(target=flush_periodically, name='log-flusher', daemon=True)
+    __flusher.start()
+
 
-    print(__prefix(level_char) + s + "\n", file=sys.stderr, flush=True)
+atexit.register(flush)
 
 
 def LogTrace(s):
@@ -0,0 +1,155 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import log
+import config
+import storage
+
+# Folder for the metrics of the last run of each plugin task, written as OpenMetrics text (<plugin>.prom, e.g. for
+# the textfile collector of the node exporter) and as json (<plugin>.json).
+# Defaults to plugin_data/metrics, can be overridden with STASH_PLUGIN_METRICS or metrics_dir in config.py
+try:
+    metrics_dir = os.environ.get('STASH_PLUGIN_METRICS') or str(config.metrics_dir)
+except AttributeError:
+    metrics_dir = ''
+
+# Stats of the bulk jobs of the current run (see bulk_job.py)
+jobs = []
+
+__lock = threading.Lock()
+# {operation: {'count', 'errors', 'seconds', 'max_seconds'}}
+__requests = {}
+# {'sent': bytes, 'received': bytes}
+__bytes = {'sent': 0, 'received': 0}
+# {cache: [hits, misses]}
+__caches = {}
+__start = time.time()
+
+
+# Resets all metrics, called at the start of every plugin run (the plugin worker runs many tasks in one process)
+def start_run():
+    global __start
+    with __lock:
+        jobs.clear()
+        __requests.clear()
+        __bytes['sent'] = __bytes['received'] = 0
+        __caches.clear()
+        __start = time.time()
+
+
+def record_job(stats):
+    with __lock:
+        jobs.append(stats)
+
+
+def record_request(operation, seconds, sent=0, received=0, error=False):
+    with __lock:
+        request = __requests.setdefault(operation, {'count': 0, 'errors': 0, 'seconds': 0.0, 'max_seconds': 0.0})
+        request['count'] += 1
+        request['errors'] += 1 if error else 0
+        request['seconds'] += seconds
+        request['max_seconds'] = max(request['max_seconds'], seconds)
+        __bytes['sent'] += sent
+        __bytes['received'] += received
+
+
+def record_cache(cache, hit):
+    with __lock:
+        counts = __caches.setdefault(cache, [0, 0])
+        counts[0 if hit else 1] += 1
+
+
+def snapshot(plugin, mode, status='ok'):
+    with __lock:
+        return {
+            'plugin': plugin,
+            'mode': mode,
+            'status': status,
+            'timestamp': round(time.time(), 3),
+            'wall_seconds': round(time.time() - __start, 3),
+            'jobs': [stats.to_dict() for stats in jobs],
+            'requests': {operation: dict(request) for operation, request in __requests.items()},
+            'bytes': dict(__bytes),
+            'caches': {
+                cache: {'hits': hits, 'misses': misses, 'hit_rate': hits / (hits + misses) if hits + misses else 0.0}
+                for cache, (hits, misses) in __caches.items()
+            }
+        }
+
+
+def __escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def __labels(**labels):
+    return '{' + ','.join(f'{name}="{__escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def to_openmetrics(run):
+    run_labels = {'plugin': run['plugin'], 'mode': run['mode']}
+    lines = []
+
+    # samples: [(labels, value)], or [(suffix, labels, value)] for metrics with several series (e.g. summaries)
+    def metric(name, metric_type, help_text, samples):
+        lines.append(f'# TYPE stash_plugin_{name} {metric_type}')
+        lines.append(f'# HELP stash_plugin_{name} {help_text}')
+        for sample in samples:
+            suffix, labels, value = sample if len(sample) == 3 else ('', *sample)
+            lines.append(f'stash_plugin_{name}{suffix}{__labels(**run_labels, **labels)} {value}')
+
+    metric('run_success', 'gauge', 'Whether the last run finished without errors',
+           [({}, 1 if run['status'] == 'ok' else 0)])
+    metric('run_timestamp_seconds', 'gauge', 'End of the last run', [({}, run['timestamp'])])
+    metric('run_wall_seconds', 'gauge', 'Wall time of the last run', [({}, run['wall_seconds'])])
+    metric('entities', 'gauge', 'Entities processed by the bulk jobs of the last run',
+           [({'job': job['name'], 'status': status}, job[status])
+            for job in run['jobs'] for status in ('scanned', 'updated', 'skipped', 'failed')])
+    metric('job_seconds', 'gauge', 'Wall time of the bulk jobs of the last run',
+           [({'job': job['name']}, job['elapsed']) for job in run['jobs']])
+    metric('requests', 'gauge', 'GraphQL requests of the last run',
+           [({'operation': operation}, request['count']) for operation, request in run['requests'].items()])
+    metric('request_errors', 'gauge', 'Failed GraphQL requests of the last run',
+           [({'operation': operation}, request['errors']) for operation, request in run['requests'].items()])
+    metric('request_seconds', 'summary', 'Latency of the GraphQL requests of the last run',
+           [(suffix, {'operation': operation}, value) for operation, request in run['requests'].items()
+            for suffix, value in (('_count', request['count']), ('_sum', round(request['seconds'], 6)))])
+    metric('request_seconds_max', 'gauge', 'Highest latency of the GraphQL requests of the last run',
+           [({'operation': operation}, round(request['max_seconds'], 6)) for operation, request in run['requests'].items()])
+    metric('transferred_bytes', 'gauge', 'Bytes sent to and received from stash in the last run',
+           [({'direction': direction}, value) for direction, value in run['bytes'].items()])
+    metric('cache_hit_ratio', 'gauge', 'Cache hit rate of the last run',
+           [({'cache': cache}, round(counts['hit_rate'], 4)) for cache, counts in run['caches'].items()])
+    lines.append('# EOF')
+    return '\n'.join(lines) + '\n'
+
+
+# Writes the metrics of the current run, failures are only logged, they must not fail the task
+def write(plugin, json_input, status='ok'):
+    args = json_input.get('args', {}) if json_input else {}
+    mode = (args.get('hookContext') or {}).get('type') or args.get('mode') or ''
+    run = snapshot(plugin, mode, status)
+    try:
+        directory = metrics_dir or storage.data_path('metrics')
+        os.makedirs(directory, exist_ok=True)
+        # One file per plugin and mode, so a hook run doesn't replace the metrics of the last bulk task
+        name = f"{plugin}_{mode}".rstrip('_').replace('.', '_')
+        storage.write_atomic(os.path.join(directory, name + '.prom'), to_openmetrics(run))
+        storage.write_atomic(os.path.join(directory, name + '.json'), json.dumps(run, indent=2))
+    except OSError as e:
+        log.LogWarning(f"Could not write metrics: {e}")
+    return run
+
+
+# Collects the metrics of the enclosed plugin run and writes them when it ends, also if it fails
+@contextmanager
+def measure_run(plugin, json_input):
+    start_run()
+    try:
+        yield
+    except BaseException:
+        write(plugin, json_input, 'error')
+        raise
+    write(plugin, json_input)
@@ -0,0 +1,105 @@
+from urllib.parse import urlparse
+
+import log
+
+
+# Capitalize each word
+def normalize_name(name):
+    return " ".join(x.capitalize() for x in name.strip().split(" "))
+
+
+# Resolves tag, performer and studio names returned by scrapers without stored_id to ids
+# Missing names of all scrape results are collected first, looked up once against the existing entities
+# and then created in one request per entity type. Every name is created at most once per run.
+class NameResolver:
+    def __init__(self, client, create_missing_performers=False, create_missing_tags=False, create_missing_studios=False):
+        self.client = client
+        self.create_missing_performers = create_missing_performers
+        self.create_missing_tags = create_missing_tags
+        self.create_missing_studios = create_missing_studios
+
+        # Resolved ids {normalized name: id}, loaded lazily from stash on first use
+        self.__tags = None
+        self.__performers = None
+        self.__studios = None
+
+        # Names waiting to be created
+        self.__missing_tags = set()
+        self.__missing_performers = set()
+        # {normalized name: studio url}
+        self.__missing_studios = {}
+
+    # Collects all names of the scrape result, that don't have a stored_id
+    def collect(self, scraped_data, scene_url):
+        if self.create_missing_tags:
+            for tag in scraped_data.get('tags') or []:
+                if not tag.get('stored_id') and tag.get('name'):
+                    self.__missing_tags.add(normalize_name(tag.get('name')))
+        if self.create_missing_performers:
+            for performer in scraped_data.get('performers') or []:
+                if not performer.get('stored_id') and performer.get('name'):
+                    self.__missing_performers.add(normalize_name(performer.get('name')))
+        if self.create_missing_studios:
+            studio = scraped_data.get('studio')
+            if studio and not studio.get('stored_id') and studio.get('name'):
+                studio_url = '{uri.scheme}://{uri.netloc}'.format(uri=urlparse(scene_url))
+                self.__missing_studios.setdefault(normalize_name(studio.get('name')), studio_url)
+
+    # Creates all collected names, that don't exist in stash yet
+    # Names that can't be created are logged by the client and left unresolved, they are not retried in later batches
+    def create_missing(self):
+        if self.__missing_tags:
+            try:
+                if self.__tags is None:
+                    self.__tags = {normalize_name(t['name']): t['id'] for t in self.client.listTags()}
+                names = sorted(n for n in self.__missing_tags if n not in self.__tags)
+                if names:
+                    log.LogInfo(f"Create {len(names)} missing tag(s): {', '.join(names)}")
+                    self.__tags.update(self.client.createTagsWithNames(names))
+            finally:
+                self.__missing_tags.clear()
+
+        if self.__missing_performers:
+            try:
+                if self.__performers is None:
+                    self.__performers = {normalize_name(p['name']): p['id'] for p in self.client.listPerformers() if p['name']}
+                names = sorted(n for n in self.__missing_performers if n not in self.__performers)
+                if names:
+                    log.LogInfo(f"Create {len(names)} missing performer(s): {', '.join(names)}")
+                    self.__performers.update(self.client.createPerformersByName(names))
+            finally:
+                self.__missing_performers.clear()
+
+        if self.__missing_studios:
+            try:
+                if self.__studios is None:
+                    self.__studios = {normalize_name(s['name']): s['id'] for s in self.client.listStudios()}
+                studios = {n: url for n, url in self.__missing_studios.items() if n not in self.__studios}
+                if studios:
+                    log.LogInfo(f"Create {len(studios)} missing studio(s): {', '.join(sorted(studios))}")
+                    self.__studios.update(self.client.createStudios(studios))
+            finally:
+                self.__missing_studios.clear()
+
+    def tag_ids(self, scraped_data):
+        return self.__ids(scraped_data.get('tags'), self.__tags)
+
+    def performer_ids(self, scraped_data):
+        return self.__ids(scraped_data.get('performers'), self.__performers)
+
+    def studio_id(self, scraped_data):
+        studio = scraped_data.get('studio')
+        if not studio:
+            return None
+        ids = self.__ids([studio], self.__studios)
+        return ids[0] if ids else None
+
+    @staticmethod
+    def __ids(entities, created):
+        ids = list()
+        for entity in entities or []:
+            if entity.get('stored_id'):
+                ids.append(entity.get('stored_id'))
+            elif created and entity.get('name') and normalize_name(entity.get('name')) in created:
+                ids.append(created[normalize_name(entity.get('name'))])
+        return ids
@@ -0,0 +1,100 @@
+from collections import Counter, defaultdict
+import threading
+
+# (performer list, similarity threshold, index) of the last index built by index_for
+__last_index = (None, None, None)
+__last_index_lock = threading.Lock()
+
+
+# Lowercase and collapse whitespace, so 'Jane  Doe' and 'jane doe' match
+def normalize(name):
+    return " ".join(name.lower().split())
+
+
+def split_aliases(aliases):
+    if not aliases:
+        return []
+    return [a.strip() for a in aliases.replace('/', ',').split(',') if a.strip()]
+
+
+def trigrams(name):
+    padded = f"  {name} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+# Lookup table from performer names and aliases to performer ids
+# Names take precedence over aliases. If similarity_threshold is set (0 < threshold <= 1), names without exact
+# match are matched against a trigram index and the most similar name/alias above the threshold is used.
+class PerformerIndex:
+    def __init__(self, performers=(), similarity_threshold=0):
+        self.similarity_threshold = similarity_threshold
+        # {normalized name: id}
+        self.__names = {}
+        self.__aliases = {}
+        # {trigram: set of normalized names/aliases}, only used for approximate matching
+        self.__trigrams = defaultdict(set)
+        self.__trigram_counts = {}
+
+        for performer in performers:
+            self.add(performer.get('id'), performer.get('name'), performer.get('aliases'))
+
+    def __len__(self):
+        return len(self.__names)
+
+    def add(self, performer_id, name, aliases=None):
+        if name:
+            self.__index(self.__names, normalize(name), performer_id)
+        for alias in split_aliases(aliases):
+            self.__index(self.__aliases, normalize(alias), performer_id)
+
+    def __index(self, table, key, performer_id):
+        # First performer with this name wins, same as walking the performer list in order
+        if key in table:
+            return
+        table[key] = performer_id
+        if self.similarity_threshold > 0 and key not in self.__trigram_counts:
+            grams = trigrams(key)
+            self.__trigram_counts[key] = len(grams)
+            for gram in grams:
+                self.__trigrams[gram].add(key)
+
+    # Returns the performer id for the name or None
+    def find(self, name):
+        key = normalize(name)
+        performer_id = self.__names.get(key, self.__aliases.get(key))
+        if performer_id is None and self.similarity_threshold > 0:
+            performer_id = self.find_similar(name)
+        return performer_id
+
+    # Returns the id of the most similar name/alias (Jaccard similarity of trigrams) above the threshold
+    def find_similar(self, name):
+        key = normalize(name)
+        grams = trigrams(key)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.__trigrams.get(gram, ()))
+
+        best_key = None
+        best_similarity = 0
+        for candidate, count in shared.items():
+            similarity = count / (len(grams) + self.__trigram_counts[candidate] - count)
+            if similarity > best_similarity:
+                best_key = candidate
+                best_similarity = similarity
+
+        if best_key is None or best_similarity < self.similarity_threshold:
+            return None
+        return self.__names.get(best_key, self.__aliases.get(best_key))
+
+
+# Returns the index for the performer list, reused as long as the same list is passed
+# StashInterface.listPerformers returns the same cached list until it expires or a performer is created, so the
+# plugin worker (see plugin_worker.py) doesn't rebuild the index for every task
+def index_for(performers, similarity_threshold=0):
+    global __last_index
+    with __last_index_lock:
+        last_performers, last_threshold, index = __last_index
+        if last_performers is not performers or last_threshold != similarity_threshold:
+            index = PerformerIndex(performers, similarity_threshold)
+            __last_index = (performers, similarity_threshold, index)
+        return index
@@ -0,0 +1,315 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import config
+import storage
+
+# Optional resident worker process
+# Plugin entry scripts call forward() before importing anything heavy. If the worker is enabled, the stdin json
+# is sent to the worker over a local unix socket and the worker runs the plugin with its modules, connection pool
+# and caches already loaded. Logs and output are streamed back, so stash doesn't see a difference.
+# If the worker is disabled, busy with another task or can't be started, the plugin runs in its own process as usual.
+# If stash cancels a task, only the shim gets killed. The worker notices the closed connection and cancels the task
+# (see work_queue.cancellation), tasks that don't stop within cancel_grace_seconds are ended by exiting the worker.
+# Values of config.py are loaded once by the worker. If config.py changes, the worker lets the next task run in its
+# own process and exits, so the task after that starts a worker with the new config.
+try:
+    enabled = bool(config.use_plugin_worker)
+except AttributeError:
+    enabled = False
+
+try:
+    idle_timeout = float(config.plugin_worker_idle_timeout)
+except (AttributeError, ValueError):
+    idle_timeout = 600
+
+try:
+    max_memory_mb = float(config.plugin_worker_max_memory_mb)
+except (AttributeError, ValueError):
+    max_memory_mb = 512
+
+# Seconds a cancelled task gets to stop, before the worker exits to end it
+cancel_grace_seconds = 30
+
+plugin_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Set in the worker process, so plugins run by the worker don't forward again
+WORKER_ENV = 'STASH_PLUGIN_WORKER'
+
+
+def socket_path():
+    return storage.data_path('plugin_worker.sock')
+
+
+def config_mtime():
+    try:
+        return os.path.getmtime(os.path.join(plugin_dir, 'config.py'))
+    except OSError:
+        return None
+
+
+def __connect():
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path())
+    except OSError:
+        client.close()
+        raise
+    return client
+
+
+# True if a worker is listening on the socket
+def worker_running():
+    try:
+        __connect().close()
+    except OSError:
+        return False
+    return True
+
+
+def __start_worker():
+    subprocess.Popen(
+        [sys.executable, os.path.join(plugin_dir, 'plugin_worker.py')],
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        start_new_session=True
+    )
+    # Wait for the worker to listen on the socket
+    for _ in range(50):
+        time.sleep(0.1)
+        try:
+            return __connect()
+        except OSError:
+            continue
+    return None
+
+
+# Runs the plugin in the worker and exits with its exit code
+# Returns without doing anything if the plugin has to run in this process
+def forward(plugin_file):
+    if not enabled or os.environ.get(WORKER_ENV) or not hasattr(socket, 'AF_UNIX'):
+        return
+
+    json_input = sys.stdin.read()
+    exit_code = None
+    try:
+        try:
+            client = __connect()
+        except OSError:
+            client = __start_worker()
+        if client is not None:
+            exit_code = __run_in_worker(client, plugin_file, json_input)
+    except OSError:
+        exit_code = None
+
+    if exit_code is None:
+        # Run in this process, the plugin still has to be able to read its input
+        import io
+        sys.stdin = io.StringIO(json_input)
+        return
+    sys.exit(exit_code)
+
+
+# Returns the exit code of the plugin or None, if the worker didn't run it
+def __run_in_worker(client, plugin_file, json_input):
+    with client:
+        request = {'plugin': os.path.abspath(plugin_file), 'input': json_input}
+        client.sendall((json.dumps(request) + '\n').encode())
+        for line in client.makefile('r', encoding='utf-8'):
+            message = json.loads(line)
+            if message.get('busy'):
+                return None
+            if 'exit' in message:
+                return message['exit']
+            stream = sys.stdout if message.get('stream') == 'stdout' else sys.stderr
+            stream.write(message.get('data', ''))
+            stream.flush()
+    # Worker died while running the plugin
+    return 1
+
+
+# File like object that sends everything written to it to the connected plugin shim
+class StreamWriter:
+    def __init__(self, connection, stream, lock):
+        self.connection = connection
+        self.stream = stream
+        self.lock = lock
+
+    def write(self, data):
+        if data:
+            message = json.dumps({'stream': self.stream, 'data': data}) + '\n'
+            with self.lock:
+                try:
+                    self.connection.sendall(message.encode())
+                except OSError:
+                    # Shim is gone, the task gets cancelled by Worker.__watch
+                    pass
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+class Worker:
+    def __init__(self):
+        self.busy = threading.Lock()
+        self.last_task = time.time()
+        self.config_mtime = config_mtime()
+        self.__lock_file = None
+
+    def serve(self):
+        os.environ[WORKER_ENV] = '1'
+        # Only one worker at a time, a second worker started concurrently must not remove the socket of the first
+        if not self.__lock():
+            return
+        path = socket_path()
+        if os.path.exists(path):
+            if worker_running():
+                return
+            # Left behind by a killed worker
+            os.remove(path)
+
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o077)
+        try:
+            server.bind(path)
+        finally:
+            os.umask(old_umask)
+        server.listen()
+        server.settimeout(1)
+
+        try:
+            while True:
+                # Idle shutdown, or restart after the memory limit has been reached or config.py changed
+                if not self.busy.locked() and (time.time() - self.last_task > idle_timeout or self.__memory_exceeded()
+                                               or self.__config_changed()):
+                    return
+
+                try:
+                    connection, _ = server.accept()
+                except socket.timeout:
+                    continue
+
+                # Only one task at a time, the other plugin runs in its own process
+                if self.__memory_exceeded() or self.__config_changed() or not self.busy.acquire(blocking=False):
+                    with connection:
+                        try:
+                            connection.sendall((json.dumps({'busy': True}) + '\n').encode())
+                        except OSError:
+                            # Closed already, e.g. by worker_running()
+                            pass
+                    continue
+                threading.Thread(target=self.__handle, args=(connection,), daemon=True).start()
+        finally:
+            server.close()
+            os.remove(path)
+            # Let a running task finish
+            with self.busy:
+                pass
+            self.__lock_file.close()
+
+    # Returns False if another worker holds the lock
+    def __lock(self):
+        self.__lock_file = open(storage.data_path('plugin_worker.lock'), 'w')
+        try:
+            import fcntl
+        except ImportError:
+            return True
+        try:
+            fcntl.flock(self.__lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self.__lock_file.close()
+            return False
+        return True
+
+    def __config_changed(self):
+        return config_mtime() != self.config_mtime
+
+    @staticmethod
+    def __memory_exceeded():
+        try:
+            import resource
+        except ImportError:
+            return False
+        # ru_maxrss is in kilobytes on linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 > max_memory_mb
+
+    def __handle(self, connection):
+        try:
+            with connection:
+                request = json.loads(connection.makefile('r', encoding='utf-8').readline())
+                import work_queue
+                work_queue.cancellation.clear()
+                done = threading.Event()
+                threading.Thread(target=self.__watch, args=(connection, done), daemon=True).start()
+                try:
+                    exit_code = self.__run_plugin(connection, request)
+                finally:
+                    done.set()
+                connection.sendall((json.dumps({'exit': exit_code}) + '\n').encode())
+        except (OSError, ValueError):
+            pass
+        finally:
+            self.last_task = time.time()
+            self.busy.release()
+
+    # Cancels the running task if the shim disconnects (the shim sends nothing after the request)
+    @staticmethod
+    def __watch(connection, done):
+        import select
+        import work_queue
+
+        while not done.is_set():
+            try:
+                readable, _, _ = select.select([connection], [], [], 1)
+                if readable and not connection.recv(1):
+                    break
+            except (OSError, ValueError):
+                break
+        if done.is_set():
+            return
+
+        work_queue.cancellation.set()
+        if not done.wait(cancel_grace_seconds):
+            # The task doesn't check for cancellation, it must not keep changing the library
+            os._exit(1)
+
+    @staticmethod
+    def __run_plugin(connection, request):
+        import io
+        import runpy
+        import traceback
+
+        plugin = os.path.abspath(request.get('plugin', ''))
+        if os.path.dirname(plugin) != plugin_dir or not os.path.isfile(plugin):
+            return 2
+
+        lock = threading.Lock()
+        stdin, stdout, stderr = sys.stdin, sys.stdout, sys.stderr
+        sys.stdin = io.StringIO(request.get('input', ''))
+        sys.stdout = StreamWriter(connection, 'stdout', lock)
+        sys.stderr = StreamWriter(connection, 'stderr', lock)
+        try:
+            runpy.run_path(plugin, run_name='__main__')
+            return 0
+        except SystemExit as e:
+            if e.code is None or isinstance(e.code, int):
+                return e.code or 0
+            print(e.code, file=sys.stderr)
+            return 1
+        except Exception:
+            traceback.print_exc(file=sys.stderr)
+            return 1
+        finally:
+            # Buffered log messages belong to this task
+            if 'log' in sys.modules:
+                sys.modules['log'].flush()
+            sys.stdin, sys.stdout, sys.stderr = stdin, stdout, stderr
+
+
+if __name__ == '__main__':
+    Worker().serve()
@@ -0,0 +1,103 @@
+import itertools
+import threading
+import time
+
+import log
+import config
+
+# Maximum number of progress updates sent to stash per second
+try:
+    progress_updates_per_second = float(config.progress_updates_per_second)
+except (AttributeError, ValueError):
+    progress_updates_per_second = 2
+
+# Seconds between info lines with throughput and estimated remaining time. 0 disables them
+try:
+    progress_info_interval = float(config.progress_info_interval)
+except (AttributeError, ValueError):
+    progress_info_interval = 30
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+
+# Progress of a task with a known number of items (0 if unknown, only the throughput is reported then)
+# advance() can be called from any number of threads. Items are counted without a lock and only one thread at a
+# time sends updates, threads that find the reporter busy just continue with their work.
+class ProgressReporter:
+    def __init__(self, total, name='', updates_per_second=None, info_interval=None):
+        if updates_per_second is None:
+            updates_per_second = progress_updates_per_second
+        if info_interval is None:
+            info_interval = progress_info_interval
+
+        self.total = total
+        self.name = name
+        self.start = time.time()
+        self.min_interval = 1 / updates_per_second if updates_per_second > 0 else 0
+        self.info_interval = info_interval
+        self.done = 0
+        self.__counter = itertools.count(1)
+        self.__reported = 0
+        self.__next_update = 0.0
+        self.__next_info = self.start + info_interval if info_interval > 0 else None
+        self.__sending = threading.Lock()
+
+    # Marks one item as processed
+    def advance(self):
+        # next() on itertools.count is atomic in CPython
+        done = next(self.__counter)
+        self.done = max(self.done, done)
+        now = time.time()
+        if now < self.__next_update and (not self.total or done < self.total):
+            return
+        if not self.__sending.acquire(blocking=False):
+            return
+        try:
+            self.__send(now)
+        finally:
+            self.__sending.release()
+
+    # Removes one item from the total, e.g. an item that was already processed by a previous run
+    def skip(self):
+        if self.total:
+            self.total -= 1
+
+    # Items per second since the start
+    def rate(self):
+        elapsed = time.time() - self.start
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    # Estimated seconds until all items are processed, None if unknown
+    def eta(self):
+        rate = self.rate()
+        if rate <= 0:
+            return None
+        return max(0, self.total - self.done) / rate
+
+    def __send(self, now):
+        done = self.done
+        self.__next_update = now + self.min_interval
+        if done > self.__reported and self.total:
+            self.__reported = done
+            log.LogProgress(done / self.total)
+        if self.__next_info is not None and now >= self.__next_info:
+            self.__next_info = now + self.info_interval
+            log.LogInfo(self.summary())
+
+    def summary(self):
+        eta = self.eta()
+        prefix = f"{self.name}: " if self.name else ''
+        if not self.total:
+            return f"{prefix}{self.done} processed, {self.rate():.1f}/s"
+        percent = self.done / self.total if self.total else 1
+        return (f"{prefix}{self.done}/{self.total} ({percent:.0%}), {self.rate():.1f}/s, "
+                f"ETA {format_duration(eta) if eta is not None else 'unknown'}")
+
+    # Sends the final progress, skipped updates of the last items are not lost
+    def finish(self):
+        with self.__sending:
+            self.__send(time.time())
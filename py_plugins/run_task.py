@@ -0,0 +1,120 @@
+import argparse
+import importlib.util
+import json
+import os
+import sys
+import time
+from urllib.parse import urlparse
+
+# Runs a plugin task outside of stash, e.g. from cron or for benchmarks
+#
+#   python run_task.py bulk_url_scraper scrape --url http://localhost:9999 --api-key <key>
+#   python run_task.py gallerytags copyall --dry-run
+#
+# Connection details can also be set with the environment variables STASH_URL, STASH_API_KEY and STASH_SESSION.
+# Logs are written to stderr as usual, a json summary of the run (counts, timings, requests, errors) is printed to stdout.
+# The metrics files are written as for runs started by stash (see metrics.py).
+# The exit code is 0 if the task finished without errors, 1 otherwise
+
+plugin_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run a stash plugin task from the command line")
+    parser.add_argument('plugin', help="plugin file name, e.g. bulk_url_scraper or gallerytags.py")
+    parser.add_argument('mode', nargs='?', default='', help="task mode as in the plugin yml, e.g. scrape")
+    parser.add_argument('--url', default=os.environ.get('STASH_URL', 'http://localhost:9999'),
+                        help="stash url (default: $STASH_URL or http://localhost:9999)")
+    parser.add_argument('--api-key', default=os.environ.get('STASH_API_KEY'),
+                        help="stash api key (default: $STASH_API_KEY)")
+    parser.add_argument('--session-cookie', default=os.environ.get('STASH_SESSION'),
+                        help="stash session cookie (default: $STASH_SESSION)")
+    parser.add_argument('--arg', action='append', default=[], metavar='KEY=VALUE',
+                        help="additional plugin argument, can be repeated")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="only report what would be changed, without sending any mutations")
+    return parser.parse_args(argv)
+
+
+def server_connection(args):
+    url = urlparse(args.url if '://' in args.url else 'http://' + args.url)
+    return {
+        'Scheme': url.scheme,
+        'Host': url.hostname or 'localhost',
+        'Port': url.port or (443 if url.scheme == 'https' else 9999),
+        'SessionCookie': {'Value': args.session_cookie or ''},
+        'ApiKey': args.api_key
+    }
+
+
+def load_plugin(name):
+    if not name.endswith('.py'):
+        name += '.py'
+    path = os.path.join(plugin_dir, os.path.basename(name))
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"Plugin {name} not found in {plugin_dir}")
+
+    # File names like yt-dl_downloader.py aren't valid module names
+    module_name = os.path.splitext(os.path.basename(path))[0].replace('-', '_')
+    spec = importlib.util.spec_from_file_location(module_name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.dry_run:
+        # Read by stash_interface.py, has to be set before the plugin is loaded
+        os.environ['STASH_PLUGIN_DRY_RUN'] = '1'
+
+    plugin_args = {'mode': args.mode}
+    for arg in args.arg:
+        key, _, value = arg.partition('=')
+        plugin_args[key] = value
+    json_input = {'server_connection': server_connection(args), 'args': plugin_args}
+
+    summary = {
+        'plugin': args.plugin,
+        'mode': args.mode,
+        'dry_run': args.dry_run,
+        'status': 'ok',
+        'error': None
+    }
+    output = {}
+    start = time.time()
+    try:
+        plugin = load_plugin(args.plugin)
+        summary['load_time'] = round(time.time() - start, 3)
+        import metrics
+        with metrics.measure_run(os.path.splitext(os.path.basename(args.plugin))[0], json_input):
+            plugin.run(json_input, output)
+    except SystemExit as e:
+        # Plugins exit with a message on missing tags or failed authentication
+        if e.code not in (None, 0):
+            summary['status'] = 'error'
+            summary['error'] = str(e.code)
+    except Exception as e:
+        summary['status'] = 'error'
+        summary['error'] = f"{type(e).__name__}: {e}"
+    summary['elapsed'] = round(time.time() - start, 3)
+    summary['output'] = output.get('output')
+
+    # Only available if the plugin could be loaded
+    metrics = sys.modules.get('metrics')
+    run = metrics.snapshot(args.plugin, args.mode) if metrics is not None else {}
+    jobs = run.get('jobs', [])
+    summary['jobs'] = jobs
+    summary['requests'] = run.get('requests', {})
+    summary['bytes'] = run.get('bytes', {})
+    for counter in ('scanned', 'updated', 'skipped', 'failed'):
+        summary[counter] = sum(job[counter] for job in jobs)
+    if summary['status'] == 'ok' and summary['failed']:
+        summary['status'] = 'failed_entities'
+
+    print(json.dumps(summary, indent=2))
+    return 0 if summary['status'] == 'ok' else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
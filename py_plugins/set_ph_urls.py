@@ -1,77 +1,82 @@
+import plugin_worker
+if __name__ == '__main__':
+    plugin_worker.forward(__file__)
+
 import os
+import re
 import json
 import sys
 import log
+import metrics
 from stash_interface import StashInterface
+from changes import bulk_change, group_changes
+from bulk_job import BulkJob, grouped_sink, grouped_batch_size
 
 
 def main():
     json_input = readJSONInput()
 
-    client = StashInterface(json_input.get('server_connection'))
-    add_ph_urls(client)
-
-    output = {
-        'output': 'ok'
-    }
+    output = {}
+    with metrics.measure_run('set_ph_urls', json_input):
+        run(json_input, output)
 
     print(json.dumps(output) + '\n')
 
 
+def run(json_input, output):
+    client = StashInterface(json_input.get('server_connection'))
+    hook_context = json_input.get('args', {}).get('hookContext')
+    if hook_context:
+        # Triggered by a scene create/update hook, only handle that scene
+        add_ph_url(client, hook_context.get('id'))
+    else:
+        add_ph_urls(client)
+
+    output['output'] = 'ok'
+
+
 def readJSONInput():
     json_input = sys.stdin.read()
     return json.loads(json_input)
 
 
-def add_ph_urls(client):
-    count = 0
+# Path of videos downloaded by Youtube-dl from pornhub
+ph_path_regex = r"-ph[a-z0-9]{13}\.(?:[mM][pP]4|[wW][mM][vV])$"
 
-    scenes = client.findScenesByPathRegex(
-        r"-ph[a-z0-9]{13}\.(?:[mM][pP]4|[wW][mM][vV])$"
-    )
 
-    for scene in scenes:
-        if scene.get('url') is None or scene.get('url') == "":
-            try:
-                ph_id = os.path.splitext(scene.get('path').split('-ph')[1])[0]
-            except IndexError:
-                log.LogDebug(f"Error, skipping scene {scene.get('id')}")
-                continue
-            url = f"https://www.pornhub.com/view_video.php?viewkey=ph{ph_id}"
+def ph_url_update(scene):
+    if scene.get('url') is not None and scene.get('url') != "":
+        return None
+    try:
+        ph_id = os.path.splitext(scene.get('path').split('-ph')[1])[0]
+    except IndexError:
+        log.LogDebug(lambda: f"Error, skipping scene {scene.get('id')}")
+        return None
+    url = f"https://www.pornhub.com/view_video.php?viewkey=ph{ph_id}"
 
-            scene_data = {
-                'id': scene.get('id'),
-                'url': url
-            }
+    # Bulk updates leave the other fields unchanged
+    return bulk_change(fields={'url': url})
 
-            # Required, would be cleared otherwise
-            if scene.get('rating'):
-                scene_data['rating'] = scene.get('rating')
 
-            tag_ids = []
-            for t in scene.get('tags'):
-                tag_ids.append(t.get('id'))
-            scene_data['tag_ids'] = tag_ids
+def add_ph_url(client, scene_id):
+    scene = client.getSceneById(scene_id)
+    if scene is None or not re.search(ph_path_regex, scene.get('path') or ''):
+        return
 
-            performer_ids = []
-            for p in scene.get('performers'):
-                performer_ids.append(p.get('id'))
-            scene_data['performer_ids'] = performer_ids
+    change = ph_url_update(scene)
+    if change is not None:
+        client.bulkSceneUpdates(group_changes([(scene_id, change)]))
+        log.LogInfo(f"Set url for scene {scene_id}")
 
-            if scene.get('studio'):
-                scene_data['studio_id'] = scene.get('studio').get('id')
 
-            if scene.get('gallery'):
-                scene_data['gallery_id'] = scene.get('gallery').get('id')
-
-            if scene.get('rating'):
-                scene_data['rating'] = scene.get('rating')
+def add_ph_urls(client):
+    scenes = client.findScenesByPathRegex(ph_path_regex)
 
-            client.updateScene(scene_data)
-            log.LogDebug(f'Set url for scene {scene.get("id")}')
-            count += 1
+    stats = BulkJob('set_ph_urls', scenes, ph_url_update, batch_sink=grouped_sink(client.bulkSceneUpdates),
+                    batch_size=grouped_batch_size).run()
 
-    log.LogInfo(f"Set urls for {count} scene(s)")
+    log.LogInfo(f"Set urls for {stats.updated} scene(s)")
 
 
-main()
+if __name__ == '__main__':
+    main()
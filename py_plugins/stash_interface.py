@@ -1,8 +1,115 @@
-import requests
+import json
+import os
+import re
 import sys
+import threading
+import time
 import log
+import metrics
+from changes import apply_change, merge_changes, GALLERY_PRESERVED_FIELDS, IMAGE_PRESERVED_FIELDS, SCENE_PRESERVED_FIELDS
 from urllib.parse import urlparse
 
+# HTTP session with connection pool, shared by all clients of the process
+# The plugin worker (see plugin_worker.py) keeps it open between tasks
+session = None
+session_lock = threading.Lock()
+
+# Don't send any mutations, set by run_task.py --dry-run. Bulk jobs skip their mutations (see bulk_job.py),
+# everything else fails instead of changing the database
+dry_run = bool(os.environ.get('STASH_PLUGIN_DRY_RUN'))
+
+# Seconds cached entity lists (e.g. all tags) are reused before they are fetched again
+cache_ttl = 60
+
+
+# First field of the query or mutation (after an optional alias), used as operation name for the metrics
+operation_regex = re.compile(r'\{\s*(?:\w+\s*:\s*)?(\w+)')
+
+
+def operation_name(query):
+    match = operation_regex.search(query)
+    return match.group(1) if match else 'unknown'
+
+
+# Raised for HTTP error responses of the GraphQL endpoint
+class HTTPStatusError(ConnectionError):
+    def __init__(self, status_code, message):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+# True for errors a retry might fix: timeouts, connection problems, 5xx and 429 responses
+# Other HTTP errors (e.g. 400/422 for an invalid query or input) fail the same way every time
+def is_transient(error):
+    if isinstance(error, HTTPStatusError):
+        return error.status_code >= 500 or error.status_code == 429
+    requests = sys.modules.get('requests')
+    if requests is not None and isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    return isinstance(error, (ConnectionError, TimeoutError))
+
+
+def get_session():
+    global session
+    with session_lock:
+        if session is None:
+            # Imported with the first request, tasks that don't talk to stash don't have to load it
+            import requests
+            import requests.adapters
+
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=32)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        return session
+
+
+# Buffer for update mutations that merges all pending changes of the same entity (see changes.merge_changes)
+# Changes are queued as bulk changes (see changes.bulk_change): only the changed fields and the relation ids to add or
+# remove. The preserved fields are added once, when the update input is built on flush (see changes.apply_change),
+# so an entity changed by several steps of a task is written once and a later change can't undo an earlier one
+class WriteCoalescer:
+    def __init__(self, send, preserved=(), max_pending=100):
+        self.send = send
+        self.preserved = preserved
+        self.max_pending = max_pending
+        self.merged = 0
+        # {entity id: (entity as fetched, merged change)}
+        self.__pending = {}
+        self.__lock = threading.Lock()
+
+    def add(self, entity, change):
+        if not change:
+            return {}
+        entity_id = str(entity.get('id'))
+        with self.__lock:
+            if entity_id in self.__pending:
+                pending_entity, pending_change = self.__pending[entity_id]
+                self.__pending[entity_id] = (pending_entity, merge_changes(pending_change, change) or {})
+                self.merged += 1
+            else:
+                self.__pending[entity_id] = (entity, change)
+            full = len(self.__pending) >= self.max_pending
+        if full:
+            return self.flush()
+        return {}
+
+    # Sends all pending changes, returns {entity id: exception} of the updates that failed
+    # Entities whose changes cancel each other out aren't sent
+    def flush(self):
+        with self.__lock:
+            pending = self.__pending
+            self.__pending = {}
+        errors = {}
+        for entity_id, (entity, change) in pending.items():
+            try:
+                update = apply_change(entity, change, self.preserved)
+                if update is not None:
+                    self.send(update)
+            except Exception as e:
+                errors[entity_id] = e
+        return errors
+
 
 class StashInterface:
     port = ""
@@ -16,15 +123,28 @@ class StashInterface:
     }
     cookies = {}
 
+    # {(endpoint url, query): (timestamp, result)}, shared between clients of the same stash instance
+    cache = {}
+    cache_lock = threading.Lock()
+
     def __init__(self, conn):
+        # Buffered updates, see queueSceneUpdate
+        self.scene_writes = WriteCoalescer(self.updateScene, SCENE_PRESERVED_FIELDS)
+        self.gallery_writes = WriteCoalescer(self.updateGallery, GALLERY_PRESERVED_FIELDS)
+        self.image_writes = WriteCoalescer(self.updateImage, IMAGE_PRESERVED_FIELDS)
+
         self.port = conn['Port']
         scheme = conn['Scheme']
 
         # Session cookie for authentication
         self.cookies = {
-            'session': conn.get('SessionCookie').get('Value')
+            'session': (conn.get('SessionCookie') or {}).get('Value')
         }
 
+        # API key, if the plugin is run outside of stash (see run_task.py)
+        if conn.get('ApiKey'):
+            self.headers = dict(self.headers, ApiKey=conn.get('ApiKey'))
+
         # If stash does not accept connections from all interfaces use the host specified in the config
         host = conn.get('Host') if '0.0.0.0' not in conn.get('Host') else 'localhost'
 
@@ -32,27 +152,45 @@ class StashInterface:
         self.url = scheme + "://" + host + ":" + str(self.port) + "/graphql"
         log.LogDebug(f"Using stash GraphQl endpoint at {self.url}")
 
-    def __callGraphQL(self, query, variables=None):
-        json = {'query': query}
+    # Raises if the response contains GraphQL errors. If a list is passed as errors, the errors of a partially
+    # successful request (data and errors) are appended to it instead and the data is returned
+    def __callGraphQL(self, query, variables=None, errors=None):
+        if dry_run and query.lstrip().startswith('mutation'):
+            raise Exception("Dry run: mutation not sent")
+
+        payload = {'query': query}
         if variables is not None:
-            json['variables'] = variables
-
-        response = requests.post(self.url, json=json, headers=self.headers, cookies=self.cookies)
-
-        if response.status_code == 200:
-            result = response.json()
-            if result.get("error", None):
-                for error in result["error"]["errors"]:
-                    raise Exception("GraphQL error: {}".format(error))
-            if result.get("data", None):
-                return result.get("data")
-        elif response.status_code == 401:
-            sys.exit("HTTP Error 401, Unauthorised. Cookie authentication most likely failed")
-        else:
-            raise ConnectionError(
-                "GraphQL query failed:{} - {}. Query: {}. Variables: {}".format(
-                    response.status_code, response.content, query, variables)
-            )
+            payload['variables'] = variables
+        body = json.dumps(payload).encode()
+
+        start = time.time()
+        received = 0
+        failed = True
+        try:
+            response = get_session().post(self.url, data=body, headers=self.headers, cookies=self.cookies)
+            received = len(response.content)
+
+            if response.status_code == 200:
+                result = response.json()
+                if result.get("errors"):
+                    if errors is None or not result.get("data"):
+                        raise Exception("GraphQL error: {}".format(
+                            "; ".join(error.get("message", str(error)) for error in result["errors"])))
+                    errors.extend(result["errors"])
+                else:
+                    failed = False
+                if result.get("data", None):
+                    return result.get("data")
+            elif response.status_code == 401:
+                sys.exit("HTTP Error 401, Unauthorised. Cookie authentication most likely failed")
+            else:
+                raise HTTPStatusError(
+                    response.status_code,
+                    "GraphQL query failed:{} - {}. Query: {}. Variables: {}".format(
+                        response.status_code, response.content, query, variables)
+                )
+        finally:
+            metrics.record_request(operation_name(query), time.time() - start, len(body), received, failed)
 
     def scan_for_new_files(self):
         try:
@@ -83,17 +221,27 @@ class StashInterface:
             result = self.__callGraphQL(query)
         log.LogDebug("ScanResult" + str(result))
 
-    def findTagIdWithName(self, name):
-        query = """
-            query {
-                allTags {
-                id
-                name
-                }
-            }
-        """
+    # Runs a query without variables, the result is reused for cache_ttl seconds
+    def __cachedGraphQL(self, query):
+        key = (self.url, query)
+        with self.cache_lock:
+            cached = self.cache.get(key)
+        if cached is not None and time.time() - cached[0] < cache_ttl:
+            metrics.record_cache('graphql', True)
+            return cached[1]
+        metrics.record_cache('graphql', False)
 
         result = self.__callGraphQL(query)
+        with self.cache_lock:
+            self.cache[key] = (time.time(), result)
+        return result
+
+    def __invalidateCache(self, query):
+        with self.cache_lock:
+            self.cache.pop((self.url, query), None)
+
+    def findTagIdWithName(self, name):
+        result = self.__cachedGraphQL(self.__allTagsQuery)
 
         for tag in result["allTags"]:
             if tag["name"] == name:
@@ -113,8 +261,65 @@ class StashInterface:
         }}
 
         result = self.__callGraphQL(query, variables)
+        self.__invalidateCache(self.__allTagsQuery)
         return result["tagCreate"]["id"]
 
+    __allTagsQuery = "query {allTags {id name}}"
+
+    def listTags(self):
+        result = self.__cachedGraphQL(self.__allTagsQuery)
+        return result['allTags']
+
+    # Runs the given mutation once for every input in a single request
+    # Returns the results in the same order as the inputs
+    # If a dict is passed as errors, single failed mutations don't fail the request: their result is None and the
+    # error message is stored in errors {input index: message}
+    def __batchMutation(self, mutation, input_type, inputs, errors=None):
+        if not inputs:
+            return []
+
+        definitions = ", ".join(f"$input{i}: {input_type}!" for i in range(len(inputs)))
+        mutations = "\n".join(f"m{i}: {mutation}(input: $input{i}) {{ id }}" for i in range(len(inputs)))
+        query = f"""
+            mutation({definitions}) {{
+                {mutations}
+            }}
+        """
+        variables = {f"input{i}": mutation_input for i, mutation_input in enumerate(inputs)}
+
+        if errors is None:
+            result = self.__callGraphQL(query, variables)
+            return [result[f"m{i}"] for i in range(len(inputs))]
+
+        graphql_errors = []
+        result = self.__callGraphQL(query, variables, errors=graphql_errors)
+        for error in graphql_errors:
+            alias = (error.get("path") or [""])[0]
+            if isinstance(alias, str) and alias[1:].isdigit():
+                errors[int(alias[1:])] = error.get("message", str(error))
+        results = [result.get(f"m{i}") for i in range(len(inputs))]
+        for i, mutation_result in enumerate(results):
+            if mutation_result is None:
+                errors.setdefault(i, "no result")
+        return results
+
+    # Runs the given create mutation once for every input in a single request
+    # Returns {name: id} of the created entities, names that couldn't be created (e.g. because they exist as an
+    # alias) are logged and left out
+    def __bulkCreate(self, mutation, input_type, names, inputs):
+        errors = {}
+        results = self.__batchMutation(mutation, input_type, inputs, errors)
+        for i, message in sorted(errors.items()):
+            log.LogError(f"{mutation} failed for {names[i]}: {message}")
+        return {name: created["id"] for name, created in zip(names, results) if created is not None}
+
+    # Creates all tags in a single request, returns {name: id} of the created tags
+    def createTagsWithNames(self, names):
+        try:
+            return self.__bulkCreate("tagCreate", "TagCreateInput", names, [{'name': name} for name in names])
+        finally:
+            self.__invalidateCache(self.__allTagsQuery)
+
     def destroyTag(self, tag_id):
         query = """
             mutation tagDestroy($input: TagDestroyInput!) {
@@ -126,12 +331,14 @@ class StashInterface:
         }}
 
         self.__callGraphQL(query, variables)
+        self.__invalidateCache(self.__allTagsQuery)
 
     def getSceneById(self, scene_id):
         query = """
             query findScene($id: ID!) {
                 findScene(id: $id) {
                     id
+                    path
                     title
                     details
                     url
@@ -161,6 +368,87 @@ class StashInterface:
 
         return result.get('findScene')
 
+    def getGalleryById(self, gallery_id):
+        query = """
+            query findGallery($id: ID!) {
+                findGallery(id: $id) {
+                    id
+                    title
+                    details
+                    url
+                    date
+                    rating
+                    studio {
+                        id
+                    }
+                    tags {
+                        id
+                    }
+                    performers {
+                        id
+                    }
+                    scenes {
+                        id
+                        title
+                        details
+                        url
+                        date
+                        rating
+                        studio {
+                            id
+                        }
+                        tags {
+                            id
+                        }
+                        performers {
+                            id
+                        }
+                    }
+                }
+            }
+        """
+
+        variables = {
+            "id": gallery_id
+        }
+
+        result = self.__callGraphQL(query, variables)
+
+        return result.get('findGallery')
+
+    def getImageById(self, image_id):
+        query = """
+            query findImage($id: ID!) {
+                findImage(id: $id) {
+                    id
+                    title
+                    path
+                    created_at
+                    rating
+                    studio {
+                        id
+                    }
+                    performers {
+                        id
+                    }
+                    tags {
+                        id
+                    }
+                    galleries {
+                        id
+                    }
+                }
+            }
+        """
+
+        variables = {
+            "id": image_id
+        }
+
+        result = self.__callGraphQL(query, variables)
+
+        return result.get('findImage')
+
     def findRandomSceneId(self):
         query = """
             query findScenes($filter: FindFilterType!) {
@@ -201,6 +489,34 @@ class StashInterface:
 
         self.__callGraphQL(query, variables)
 
+    # Sends all BulkSceneUpdateInputs (see changes.group_changes) in a single request
+    # Unlike sceneUpdate, bulkSceneUpdate leaves omitted fields unchanged and can add or remove relation ids
+    def bulkSceneUpdates(self, inputs):
+        self.__batchMutation("bulkSceneUpdate", "BulkSceneUpdateInput", inputs)
+
+    # Sends all BulkGalleryUpdateInputs (see changes.group_changes) in a single request
+    def bulkGalleryUpdates(self, inputs):
+        self.__batchMutation("bulkGalleryUpdate", "BulkGalleryUpdateInput", inputs)
+
+    # Buffered variants of updateScene, updateGallery and updateImage
+    # Take the entity as fetched and a bulk change of it (see changes.bulk_change). Changes of the same entity are
+    # merged and sent as a single mutation by flushUpdates, or once 100 entities are pending.
+    # Both return {entity id: exception} of the updates that failed
+    def queueSceneUpdate(self, scene, change):
+        return self.scene_writes.add(scene, change)
+
+    def queueGalleryUpdate(self, gallery, change):
+        return self.gallery_writes.add(gallery, change)
+
+    def queueImageUpdate(self, image, change):
+        return self.image_writes.add(image, change)
+
+    def flushUpdates(self):
+        errors = {}
+        for writes in (self.scene_writes, self.gallery_writes, self.image_writes):
+            errors.update(writes.flush())
+        return errors
+
     def updateGallery(self, gallery_data):
         query = """
             mutation galleryUpdate($input: GalleryUpdateInput!) {
@@ -276,23 +592,66 @@ class StashInterface:
             log.LogDebug(f"Regex found a total of {len(scenes)} scene(s)")
         return scenes
 
-    def findGalleriesByTags(self, tag_ids):
-        return self.__findGalleriesByTags(tag_ids)
-
     # Searches for galleries with given tags
     # Requires a list of tagIds
-    def __findGalleriesByTags(self, tag_ids, page=1):
+    def findGalleriesByTags(self, tag_ids):
+        return self.__findGalleriesWithScenes({'tags': {'value': tag_ids, 'modifier': 'INCLUDES_ALL'}})
+
+    # Galleries created or updated after the given timestamp
+    def findGalleriesUpdatedSince(self, timestamp):
+        return self.__findGalleriesWithScenes({'updated_at': {'value': timestamp, 'modifier': 'GREATER_THAN'}})
+
+    # Galleries attached to any of the given scenes
+    def findGalleriesBySceneIds(self, scene_ids, chunk_size=500):
+        galleries = {}
+        for i in range(0, len(scene_ids), chunk_size):
+            gallery_filter = {'scenes': {'value': scene_ids[i:i + chunk_size], 'modifier': 'INCLUDES'}}
+            for gallery in self.__findGalleriesWithScenes(gallery_filter):
+                galleries[gallery.get('id')] = gallery
+        return list(galleries.values())
+
+    # The fields of the attached scenes are included, so the scene information can be copied without further requests
+    def __findGalleriesWithScenes(self, gallery_filter, page=1):
+        per_page = 1000
         query = """
-        query findGalleriesByTags($tags: [ID!], $page: Int) {
+        query findGalleriesWithScenes($gallery_filter: GalleryFilterType, $page: Int, $per_page: Int) {
             findGalleries(
-                gallery_filter: { tags: { value: $tags, modifier: INCLUDES_ALL } }
-                filter: { per_page: 100, page: $page }
+                gallery_filter: $gallery_filter
+                filter: { per_page: $per_page, page: $page }
             ) {
                 count
                 galleries {
                     id
+                    title
+                    details
+                    url
+                    date
+                    rating
+                    studio {
+                        id
+                    }
+                    tags {
+                        id
+                    }
+                    performers {
+                        id
+                    }
                     scenes {
                         id
+                        title
+                        details
+                        url
+                        date
+                        rating
+                        studio {
+                            id
+                        }
+                        tags {
+                            id
+                        }
+                        performers {
+                            id
+                        }
                     }
                 }
             }
@@ -300,8 +659,9 @@ class StashInterface:
         """
 
         variables = {
-            "tags": tag_ids,
-            "page": page
+            "gallery_filter": gallery_filter,
+            "page": page,
+            "per_page": per_page
         }
 
         result = self.__callGraphQL(query, variables)
@@ -309,28 +669,31 @@ class StashInterface:
         galleries = result.get('findGalleries').get('galleries')
 
         # If page is full, also scan next page(s) recursively:
-        if len(galleries) == 100:
-            next_page = self.__findGalleriesByTags(tag_ids, page + 1)
+        if len(galleries) == per_page:
+            next_page = self.__findGalleriesWithScenes(gallery_filter, page + 1)
             for gallery in next_page:
                 galleries.append(gallery)
 
         return galleries
 
+    # Returns id and studio of the galleries matching the filter
     def findGalleries(self, gallery_filter=None):
         return self.__findGalleries(gallery_filter)
 
     def __findGalleries(self, gallery_filter=None, page=1):
-        per_page = 100
+        per_page = 1000
         query = """
-            query($studio_ids: [ID!], $page: Int, $per_page: Int) {
+            query($gallery_filter: GalleryFilterType, $page: Int, $per_page: Int) {
                 findGalleries(
-                    gallery_filter: { studios: { modifier: INCLUDES, value: $studio_ids } }
+                    gallery_filter: $gallery_filter
                     filter: { per_page: $per_page, page: $page }
                 ) {
                     count
                     galleries {
                         id
                         studio {id}
+                        tags {id}
+                        performers {id}
                     }
                 }
             }
@@ -356,17 +719,26 @@ class StashInterface:
         return galleries
 
     def findImages(self, image_filter=None):
-        return self.__findImages(image_filter)
-
-    def __findImages(self, image_filter=None, page=1):
         per_page = 1000
+        images = []
+        page = 1
+        while True:
+            page_images = self.findImagesPage(page, per_page, image_filter)
+            images += page_images
+            if len(page_images) < per_page:
+                return images
+            page += 1
+
+    # Returns a single page of images, sorted by path so updates of other fields don't move images between pages
+    def findImagesPage(self, page, per_page=1000, image_filter=None):
         query = """
         query($per_page: Int, $page: Int, $image_filter: ImageFilterType) {
-            findImages(image_filter: $image_filter ,filter: { per_page: $per_page, page: $page }) {
-                count
+            findImages(image_filter: $image_filter, filter: { per_page: $per_page, page: $page, sort: "path", direction: ASC }) {
                 images {
                     id
                     title
+                    path
+                    created_at
                     studio {
                         id
                     }
@@ -393,15 +765,51 @@ class StashInterface:
             variables['image_filter'] = image_filter
 
         result = self.__callGraphQL(query, variables)
+        return result.get('findImages').get('images')
+
+    def countImages(self, image_filter=None):
+        query = """
+        query($image_filter: ImageFilterType) {
+            findImages(image_filter: $image_filter, filter: { per_page: 0 }) {
+                count
+            }
+        }
+        """
+
+        variables = {}
+        if image_filter:
+            variables['image_filter'] = image_filter
+
+        result = self.__callGraphQL(query, variables)
+        return result.get('findImages').get('count')
 
-        images = result.get('findImages').get('images')
+    # Returns only the ids of the images matching the filter
+    def findImageIds(self, image_filter=None, page=1):
+        per_page = 1000
+        query = """
+        query($per_page: Int, $page: Int, $image_filter: ImageFilterType) {
+            findImages(image_filter: $image_filter, filter: { per_page: $per_page, page: $page }) {
+                images {
+                    id
+                }
+            }
+        }
+        """
 
-        if len(images) == per_page:
-            next_page = self.__findImages(image_filter, page + 1)
-            for image in next_page:
-                images.append(image)
+        variables = {
+            'per_page': per_page,
+            'page': page
+        }
+        if image_filter:
+            variables['image_filter'] = image_filter
 
-        return images
+        result = self.__callGraphQL(query, variables)
+        image_ids = [image.get('id') for image in result.get('findImages').get('images')]
+
+        if len(image_ids) == per_page:
+            image_ids += self.findImageIds(image_filter, page + 1)
+
+        return image_ids
 
     def updateImageStudio(self, image_ids, studio_id):
         query = """
@@ -419,6 +827,24 @@ class StashInterface:
 
         self.__callGraphQL(query, variables)
 
+    # Adds (or removes/sets with mode REMOVE/SET) tags and performers to all given images with a single mutation
+    def bulkImageUpdate(self, image_ids, tag_ids=None, performer_ids=None, mode='ADD'):
+        query = """
+        mutation($input: BulkImageUpdateInput!) {
+            bulkImageUpdate(input: $input) {
+                id
+            }
+        }
+        """
+
+        bulk_input = {'ids': image_ids}
+        if tag_ids:
+            bulk_input['tag_ids'] = {'ids': tag_ids, 'mode': mode}
+        if performer_ids:
+            bulk_input['performer_ids'] = {'ids': performer_ids, 'mode': mode}
+
+        self.__callGraphQL(query, {'input': bulk_input})
+
     def findScenesByTags(self, tag_ids):
         return self.__findScenesByTags(tag_ids)
 
@@ -433,7 +859,21 @@ class StashInterface:
                 scenes {
                     id
                     path
+                    title
+                    details
                     url
+                    date
+                    rating
+                    created_at
+                    studio {
+                        id
+                    }
+                    tags {
+                        id
+                    }
+                    galleries {
+                        id
+                    }
                     performers {
                         id
                         name
@@ -458,6 +898,36 @@ class StashInterface:
 
         return scenes
 
+    # Ids of the scenes created or updated after the given timestamp
+    def findSceneIdsUpdatedSince(self, timestamp, page=1):
+        per_page = 1000
+        query = """
+        query($scene_filter: SceneFilterType, $page: Int, $per_page: Int) {
+            findScenes(
+                scene_filter: $scene_filter
+                filter: { per_page: $per_page, page: $page }
+            ) {
+                scenes {
+                    id
+                }
+            }
+        }
+        """
+
+        variables = {
+            "scene_filter": {'updated_at': {'value': timestamp, 'modifier': 'GREATER_THAN'}},
+            "page": page,
+            "per_page": per_page
+        }
+
+        result = self.__callGraphQL(query, variables)
+        scene_ids = [scene.get('id') for scene in result.get('findScenes').get('scenes')]
+
+        if len(scene_ids) == per_page:
+            scene_ids += self.findSceneIdsUpdatedSince(timestamp, page + 1)
+
+        return scene_ids
+
     # Scrape
     def scrapeSceneURL(self, url):
         query = """
@@ -523,6 +993,7 @@ class StashInterface:
         }
 
         result = self.__callGraphQL(query, variables)
+        self.__invalidateCache(self.__allStudiosQuery)
         return result.get("studioCreate").get("id")
 
     def createPerformerByName(self, name):
@@ -539,8 +1010,27 @@ class StashInterface:
         }
 
         result = self.__callGraphQL(query, variables)
+        self.__invalidateCache(self.__allPerformersQuery)
         return result.get('performerCreate').get('id')
 
+    # Creates all performers in a single request, returns {name: id} of the created performers
+    def createPerformersByName(self, names):
+        try:
+            return self.__bulkCreate("performerCreate", "PerformerCreateInput", names,
+                                     [{'name': name} for name in names])
+        finally:
+            self.__invalidateCache(self.__allPerformersQuery)
+
+    # Creates all studios in a single request
+    # Requires a dict {name: url}, returns {name: id} of the created studios
+    def createStudios(self, studios):
+        names = list(studios.keys())
+        try:
+            return self.__bulkCreate("studioCreate", "StudioCreateInput", names,
+                                     [{'name': name, 'url': studios[name]} for name in names])
+        finally:
+            self.__invalidateCache(self.__allStudiosQuery)
+
     def findMovieByName(self, name):
         query = "query {allMovies {id name aliases date rating studio {id name} director synopsis}}"
 
@@ -551,15 +1041,23 @@ class StashInterface:
                 return movie
         return None
 
+    __allPerformersQuery = "query {allPerformers {id name aliases}}"
+
+    # The list is cached like the tag list, the same list object is returned while it is cached
     def listPerformers(self):
-        query = "query {allPerformers {id name aliases}}"
-        result = self.__callGraphQL(query)
+        result = self.__cachedGraphQL(self.__allPerformersQuery)
         return result['allPerformers']
 
+    __allStudiosQuery = "query {allStudios {id name}}"
+
+    def listStudios(self):
+        result = self.__cachedGraphQL(self.__allStudiosQuery)
+        return result['allStudios']
+
     def sceneScraperURLs(self):
         query = "query {listSceneScrapers {name scene {urls supported_scrapes}}}"
 
-        response = self.__callGraphQL(query)
+        response = self.__cachedGraphQL(query)
         url_lists = [x.get('scene').get('urls') for x in response.get('listSceneScrapers')
                      if 'URL' in x.get('scene').get('supported_scrapes')]
         return [urlparse('https://' + url).netloc for sublist in url_lists for url in sublist]
@@ -0,0 +1,43 @@
+import json
+import os
+import pathlib
+
+# Folder for state that has to survive between plugin runs (checkpoint journals, caches, watermarks)
+# Can be overwritten with the STASH_PLUGIN_DATA environment variable
+data_dir = os.environ.get(
+    'STASH_PLUGIN_DATA',
+    str(pathlib.Path(__file__).parent.parent.joinpath('plugin_data').absolute())
+)
+
+
+# Returns the absolute path for the given file name inside the data folder
+# Creates the data folder if it doesn't exist yet
+def data_path(name):
+    os.makedirs(data_dir, exist_ok=True)
+    return os.path.join(data_dir, name)
+
+
+def load_json(name, default=None):
+    path = data_path(name)
+    if not os.path.isfile(path):
+        return default
+    try:
+        with open(path) as json_file:
+            return json.load(json_file)
+    except ValueError:
+        # Corrupted file, e.g. from a killed process
+        return default
+
+
+# Writes the file atomically, so a crash never leaves a half written file behind
+def save_json(name, data):
+    write_atomic(data_path(name), json.dumps(data))
+
+
+def write_atomic(path, text):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as out_file:
+        out_file.write(text)
+        out_file.flush()
+        os.fsync(out_file.fileno())
+    os.replace(tmp_path, path)
@@ -1,92 +1,106 @@
+import plugin_worker
+if __name__ == '__main__':
+    plugin_worker.forward(__file__)
+
 import json
+import os
 import sys
+from datetime import datetime, timezone
+
 import log
-import threading
-from queue import Queue
+import metrics
+import storage
+import stash_interface
 from stash_interface import StashInterface
+from bulk_job import BulkJob, paged
+from changes import diff_update, IMAGE_PRESERVED_FIELDS
+
+# Time of the last successful run, later runs only check images created after it
+watermark_file = 'update_image_titles_watermark.json'
 
 
 def main():
     json_input = readJSONInput()
 
-    client = StashInterface(json_input.get('server_connection'))
-    update_image_titles(client)
-
-    output = {
-        'output': 'ok'
-    }
+    output = {}
+    with metrics.measure_run('update_image_titles', json_input):
+        run(json_input, output)
 
     print(json.dumps(output) + '\n')
 
 
+def run(json_input, output):
+    client = StashInterface(json_input.get('server_connection'))
+    hook_context = json_input.get('args', {}).get('hookContext')
+    if hook_context:
+        # Triggered by the image create hook, only update that image
+        update_image_title(client, hook_context.get('id'))
+    else:
+        update_image_titles(client, full=json_input.get('args', {}).get('mode') == 'full')
+
+    output['output'] = 'ok'
+
+
 def readJSONInput():
     json_input = sys.stdin.read()
     return json.loads(json_input)
 
 
-def thread_function(q: Queue, thread_lock: threading.Lock, count: int, total: int, client: StashInterface):
-    log.LogDebug(f"Created {threading.current_thread().name}")
-    while not q.empty():
-        image = q.get()
-
-        image_data = {
-            'id': image.get('id'),
-            'title': image.get('title')
-        }
-        if image.get('rating'):
-            image_data['rating'] = image.get('rating')
-        if image.get('studio'):
-            image_data['studio_id'] = image.get('studio').get('id')
-        if image.get('performers'):
-            performer_ids = [p.get('id') for p in image.get('performers')]
-            image_data['performer_ids'] = performer_ids
-        if image.get('tags'):
-            tag_ids = [t.get('id') for t in image.get('tags')]
-            image_data['tag_ids'] = tag_ids
-        if image.get('galleries'):
-            gallery_ids = [g.get('id') for g in image.get('galleries')]
-            image_data['gallery_ids'] = gallery_ids
-
-        client.updateImage(image_data)
-
-        thread_lock.acquire()
-        count += 1
-        log.LogProgress(count / total)
-        thread_lock.release()
-
-        q.task_done()
-    log.LogDebug(f"{threading.current_thread().name} finished")
-    return True
-
-
-def update_image_titles(client, nmb_threads=8):
-    log.LogInfo('Getting all images...')
-    images = client.findImages()
-    total = len(images)
+# Title used for natural sort: the existing title, or the file name for images without a title
+def sort_title(image):
+    if image.get('title'):
+        return image.get('title')
+    return os.path.basename(image.get('path') or '') or None
+
+
+# Returns the update for images that don't have the title needed for natural sort, None otherwise
+def image_update(image):
+    image_data = {
+        'id': image.get('id'),
+        'title': sort_title(image)
+    }
+    return diff_update(image, image_data, IMAGE_PRESERVED_FIELDS)
+
+
+def update_image_title(client, image_id):
+    image = client.getImageById(image_id)
+    if image is None:
+        return
+    image_data = image_update(image)
+    if image_data is None:
+        return
+    client.updateImage(image_data)
+    log.LogDebug(f"Updated image {image_id}")
+
+
+# Only images created after the last successful run are checked, unless full is set
+def update_image_titles(client, nmb_threads=None, per_page=1000, full=False):
+    started = datetime.now(timezone.utc).isoformat(timespec='seconds')
+    watermark = None if full else storage.load_json(watermark_file, {}).get('created_at')
+    image_filter = None
+    if watermark:
+        log.LogInfo(f"Checking images created since {watermark}")
+        image_filter = {'created_at': {'value': watermark, 'modifier': 'GREATER_THAN'}}
+
+    total = client.countImages(image_filter)
     log.LogInfo(f"Found {total} images")
     if total == 0:
-        log.LogInfo('Why are you even running this plugin?')
+        log.LogInfo('No new images since the last run' if watermark else 'Why are you even running this plugin?')
         return
 
-    # nmb of finished images
-    count = 0
-    # in the rare case, that there are less then #threads images
-    nmb_threads = min(nmb_threads, total)
-    thread_lock = threading.Lock()
-    q = Queue(maxsize=0)
-    for image in images:
-        q.put(image)
-
     log.LogInfo('Start updating images (this might take a while)')
-    # Create threads and start them
-    for i in range(nmb_threads):
-        worker = threading.Thread(target=thread_function, name=f"Thread-{i}", args=(q, thread_lock, count, total, client))
-        worker.start()
+    # Pages are fetched while the images are updated, only a few pages are in memory at any time
+    images = paged(lambda page: client.findImagesPage(page, per_page, image_filter), per_page)
+    # Number of parallel requests is adjusted to the load of the stash server, unless nmb_threads is set
+    stats = BulkJob('update_image_titles', images, image_update, sink=client.updateImage, workers=nmb_threads,
+                    total=total).run()
 
-    # Wait for all threads to be finished
-    q.join()
+    # Images that failed or weren't processed have to be checked again by the next run
+    if not stats.failed and not stats.interrupted and not stash_interface.dry_run:
+        storage.save_json(watermark_file, {'created_at': started})
 
-    log.LogInfo(f'Finished updating all {total} images')
+    log.LogInfo(f'Finished updating {stats.updated} images, {stats.skipped} already had a title')
 
 
-main()
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+import threading
+import time
+from urllib.parse import urlparse
+
+import log
+import config
+import storage
+
+# Maximum runtime of bulk tasks in minutes. The task stops cleanly once the budget is used up,
+# the remaining entities are processed by the next run. 0 means no limit
+try:
+    time_budget = float(config.time_budget)
+except (AttributeError, ValueError):
+    time_budget = 0
+
+# Order in which scenes are processed by the bulk scene tasks:
+# '' (order returned by stash), 'newest', 'hit_rate' (domains with the best scrape results first),
+# 'failed_last' (scenes that couldn't be scraped in previous runs last)
+try:
+    scene_priority = str(config.scene_priority)
+except AttributeError:
+    scene_priority = ''
+
+PRIORITIES = ('', 'newest', 'hit_rate', 'failed_last')
+
+# Scrape results of previous runs
+history_file = 'scrape_history.json'
+
+
+class TimeBudget:
+    def __init__(self, minutes=None):
+        if minutes is None:
+            minutes = time_budget
+        self.minutes = minutes
+        self.deadline = time.time() + minutes * 60 if minutes > 0 else None
+        self.__logged = False
+        self.__lock = threading.Lock()
+
+    def remaining(self):
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.time())
+
+    def exhausted(self):
+        if self.deadline is None or time.time() < self.deadline:
+            return False
+        with self.__lock:
+            if not self.__logged:
+                self.__logged = True
+                log.LogWarning(f"Time budget of {self.minutes} minutes used up, the remaining entities are left for the next run")
+        return True
+
+
+# Set if the running task gets cancelled in stash while it runs in the plugin worker (see plugin_worker.py)
+# Bulk jobs stop like on an exhausted time budget, the checkpoint journal keeps the progress for the next run
+cancellation = threading.Event()
+
+
+def domain(scene):
+    if not scene.get('url'):
+        return None
+    return urlparse(scene.get('url')).netloc
+
+
+# Scrape hit rate per domain and scenes that failed in previous runs
+class ScrapeHistory:
+    def __init__(self):
+        history = storage.load_json(history_file, {})
+        # {domain: [hits, attempts]}
+        self.domains = history.get('domains', {})
+        self.failed = set(history.get('failed', []))
+        self.__lock = threading.Lock()
+
+    def record(self, scene, success):
+        scene_id = str(scene.get('id'))
+        scene_domain = domain(scene)
+        with self.__lock:
+            if success:
+                self.failed.discard(scene_id)
+            else:
+                self.failed.add(scene_id)
+            if scene_domain:
+                stats = self.domains.setdefault(scene_domain, [0, 0])
+                stats[0] += 1 if success else 0
+                stats[1] += 1
+
+    # Hit rate with a prior of 50%, so domains without history aren't ranked last
+    def hit_rate(self, scene):
+        hits, attempts = self.domains.get(domain(scene), (0, 0))
+        return (hits + 1) / (attempts + 2)
+
+    def save(self):
+        with self.__lock:
+            storage.save_json(history_file, {'domains': self.domains, 'failed': sorted(self.failed)})
+
+    # Returns the scenes sorted by the given priority
+    def prioritize(self, scenes, priority=None):
+        if priority is None:
+            priority = scene_priority
+        if priority not in PRIORITIES:
+            log.LogWarning(f"Unknown scene priority '{priority}', using the order returned by stash")
+            return scenes
+
+        # sorted is stable, scenes with the same priority keep their order
+        if priority == 'newest':
+            return sorted(scenes, key=lambda s: s.get('created_at') or '', reverse=True)
+        if priority == 'hit_rate':
+            return sorted(scenes, key=self.hit_rate, reverse=True)
+        if priority == 'failed_last':
+            return sorted(scenes, key=lambda s: str(s.get('id')) in self.failed)
+        return scenes
@@ -1,5 +1,9 @@
-import youtube_dl
+import plugin_worker
+if __name__ == '__main__':
+    plugin_worker.forward(__file__)
+
 import log
+import metrics
 import configparser
 import pathlib
 import re
@@ -9,6 +13,9 @@ import os
 import shutil
 
 from stash_interface import StashInterface
+from changes import bulk_change, add_relation, is_changed
+from bulk_job import BulkJob, grouped_sink, grouped_batch_size
+from progress import ProgressReporter
 
 current_path = str(pathlib.Path(__file__).parent.absolute())
 plugin_folder = str(pathlib.Path(current_path + '/../yt-dl_downloader/').absolute())
@@ -19,7 +26,8 @@ def main():
     json_input = read_json_input()
 
     output = {}
-    run(json_input, output)
+    with metrics.measure_run('yt-dl_downloader', json_input):
+        run(json_input, output)
 
     out = json.dumps(output)
     print(out + "\n")
@@ -61,11 +69,9 @@ def tag_scenes(client):
         log.LogDebug(beginRegex + endRegex)
         scenes = client.findScenesByPathRegex(beginRegex)
 
-        total = len(scenes)
-        i = 0
-        for scene in scenes:
-            i += 1
-            log.LogProgress(i/total)
+        scrape_tag = get_scrape_tag(client)
+
+        def tag_scene(scene):
             log.LogDebug(os.path.join("ScenePath", scene.get('path')))
             basename = os.path.basename(scene.get('path'))
             filename = os.path.splitext(basename)[0]
@@ -75,38 +81,21 @@ def tag_scenes(client):
                 if video['id'] in filename:
                     found_video = video
                     break
-            if found_video is not None:
-                scene_data = {
-                    'id': scene.get('id'),
-                    'url': video['url'],
-                    'title': video['title']
-                }
-
-                # Required, would be cleared otherwise
-                if scene.get('rating'):
-                    scene_data['rating'] = scene.get('rating')
-
-                tag_ids = []
-                for t in scene.get('tags'):
-                    tag_ids.append(t.get('id'))
-                tag_ids.append(get_scrape_tag(client))
-                scene_data['tag_ids'] = tag_ids
+            if found_video is None:
+                return None
 
-                performer_ids = []
-                for p in scene.get('performers'):
-                    performer_ids.append(p.get('id'))
-                scene_data['performer_ids'] = performer_ids
+            scene_data = {
+                'url': found_video['url'],
+                'title': found_video['title']
+            }
+            fields = {field: value for field, value in scene_data.items() if is_changed(scene, field, value)}
 
-                if scene.get('studio'):
-                    scene_data['studio_id'] = scene.get('studio').get('id')
+            # The scrape tag is added to all scenes with a single bulk update, the other tags are left unchanged
+            tag_change = add_relation(scene, 'tag_ids', [scrape_tag]) or {}
+            return bulk_change(fields=fields, add=tag_change.get('add'))
 
-                if scene.get('gallery'):
-                    scene_data['gallery_id'] = scene.get('gallery').get('id')
-
-                if scene.get('rating'):
-                    scene_data['rating'] = scene.get('rating')
-
-                client.updateScene(scene_data)
+        BulkJob('tag_downloads', scenes, tag_scene, batch_sink=grouped_sink(client.bulkSceneUpdates),
+                batch_size=grouped_batch_size).run()
 
 
 def get_scrape_tag(client):
@@ -124,13 +113,12 @@ def read_urls_and_download():
     with open(os.path.join(plugin_folder, 'urls.txt'), 'r') as url_file:
         urls = url_file.readlines()
     downloaded = []
-    total = len(urls)
-    i = 0
+    progress = ProgressReporter(len(urls), 'download')
     for url in urls:
-        i += 1
-        log.LogProgress(i/total)
         if check_url_valid(url.strip()):
             download(url.strip(), downloaded)
+        progress.advance()
+    progress.finish()
     if os.path.isfile(downloaded_json):
         shutil.move(downloaded_json, downloaded_backup_json)
     with open(downloaded_json, 'w') as outfile:
@@ -157,6 +145,9 @@ def download(url, downloaded):
     download_dir = str(pathlib.Path(config.get('PATHS', 'downloadDir') + '/%(id)s.%(ext)s').absolute())
     log.LogDebug("Downloading " + url + " to: " + download_dir)
 
+    # Only needed for downloads, the tag mode doesn't have to load it
+    import youtube_dl
+
     ydl = youtube_dl.YoutubeDL({
         'outtmpl': download_dir,
         'format': 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best',
@@ -187,4 +178,5 @@ def add_tag(client):
         log.LogInfo("Tag already exists")
 
 
-main()
+if __name__ == '__main__':
+    main()